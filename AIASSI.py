@@ -1,15 +1,33 @@
-import streamlit as st
-import google.generativeai as genai
-from PIL import Image
+import sys
 import time
+# 只有进程内第一次执行脚本时才真正加载模块，这时记录冷启动导入耗时
+cold_start = "metrics" not in sys.modules
+imports_started = time.perf_counter()
+import streamlit as st
+import datetime
 import os
-import tempfile
-import docx
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from gtts import gTTS
-from io import BytesIO
+import hashlib
+import json
+import queue
+import random
+import threading
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait
+from ingest import INGEST_DEADLINE, INGEST_WORKERS, TEXT_EXTS, extract_text, ingest_one, new_upload_cache
+from response_cache import ResponseCache, make_key
+from session_store import MappedView, SessionRegistry
+from chat_memory import ConversationMemory
+from llm_backend import BACKEND_NAME, DEFAULT_MODEL_NAME, create_backend
+from request_scheduler import BATCH, scheduler_for
+from image_prep import format_bytes
+from modes import (CAPTION_PROMPT, CAPTION_STYLES, COACH_LANGUAGES, COACH_SCENARIOS, CONTRACT_PROMPT, MEDICAL_PROMPTS, MEETING_PROMPT,
+                   OPENER_TONES, SCRIPT_PROMPT, caption_request, clause_reviewable, contract_clauses, contract_report, contract_request,
+                   inline_blob, medical_request, meeting_job, meeting_request, opener_prompt, photo_qa_request, run_meeting_map,
+                   script_request)
+# 各模块专用的依赖 (TTS、检索、EPUB、合同、会议) 在对应函数里按需导入，冷启动不加载
+if cold_start: metrics.observe("cold_imports", time.perf_counter() - imports_started)
+
+script_started = time.perf_counter()
 
 # --- 页面全局配置 ---
 st.set_page_config(
@@ -100,6 +118,17 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 侧边栏配置 ---
+MODES = [
+    "🗣️ 口语陪练教练", # 新增模块
+    "📸 你拍我答 (万能问答)",
+    "💬 一起聊天吧 (全知全能)",
+    "📚 全库文档问答 (PDF/Word/Epub)",
+    "⚖️ 法律合同审查 (Word/PDF)",
+    "🎙️ 会议纪要生成器",
+    "🏥 医疗健康助手",
+    "💻 自动化脚本写手",
+    "✨ 社交配文生成"
+]
 with st.sidebar:
     st.title("🔮 神经中枢")
     try:
@@ -107,7 +136,10 @@ with st.sidebar:
     except FileNotFoundError:
         secrets_key = ""
 
-    if secrets_key:
+    if BACKEND_NAME == "fake":
+        st.warning("🧪 离线假后端 (AIASSI_BACKEND=fake)")
+        api_key = ""
+    elif secrets_key:
         st.success("✅ 视觉神经已连接 (Secrets)")
         if st.toggle("🔧 切换手动 Key"):
             api_key = st.text_input("输入新 Key", type="password")
@@ -117,199 +149,521 @@ with st.sidebar:
         api_key = st.text_input("🔑 API Key", type="password", help="在此输入 Key 激活所有功能")
     
     st.markdown("---")
-    selected_mode = st.radio(
-        "启用功能模块",
-        [
-            "🗣️ 口语陪练教练", # 新增模块
-            "📸 你拍我答 (万能问答)",
-            "💬 一起聊天吧 (全知全能)",
-            "📚 全库文档问答 (PDF/Word/Epub)",
-            "⚖️ 法律合同审查 (Word/PDF)",
-            "🎙️ 会议纪要生成器",
-            "🏥 医疗健康助手",
-            "💻 自动化脚本写手",
-            "✨ 社交配文生成"
-        ]
-    )
+    selected_mode = st.radio("启用功能模块", MODES)
+    stream_output = st.toggle("⚡ 流式输出", value=True, help="边生成边显示；关闭后等待完整结果再渲染")
+    use_response_cache = st.toggle("♻️ 复用历史结果", value=True, help="同一文件 + 同样选项直接返回上次结果；关闭则强制重新生成")
+    dev_panel = st.toggle("🛠️ 开发者面板", value=False, help="显示各阶段耗时、token 用量，并导出 Prometheus 指标")
     st.caption("🚀 Core: gyuniku 1.5/2.5 Flash")
 
 # --- 核心逻辑函数 ---
 
+MODEL_NAME = DEFAULT_MODEL_NAME
+# 聊天类模块单轮 prompt 的 token 上限，超出部分滚动折叠成摘要
+CHAT_TOKEN_BUDGET = 6000
+# 按 API Key 缓存的客户端和上传缓存：访客手动输入的每个 Key 各占一份，限制个数并定时释放
+KEY_CACHE_ENTRIES = 32
+KEY_CACHE_TTL = 6 * 3600
+
+@st.cache_resource(max_entries=KEY_CACHE_ENTRIES, ttl=KEY_CACHE_TTL)
+def get_backend(key, model_name):
+    """按 (api_key, 模型) 复用同一个后端客户端，所有模块都经由它调用模型"""
+    return create_backend(key, model_name)
+
 def get_model():
-    if not api_key:
+    if not api_key and BACKEND_NAME != "fake":
         st.error("🛑 神经中枢未连接：请配置 API Key")
         return None
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash-preview-09-2025')
-
-def generate_speech(text, lang_code):
-    """生成语音 (gTTS)"""
-    try:
-        if not text: return None
-        # gTTS 语言代码映射
-        tts_lang = lang_code
-        if lang_code == 'ko-KR': tts_lang = 'ko'
-        elif lang_code == 'ja-JP': tts_lang = 'ja'
-        elif lang_code == 'en-US': tts_lang = 'en'
-        elif lang_code == 'fr-FR': tts_lang = 'fr'
-        elif lang_code == 'th-TH': tts_lang = 'th'
-        
-        tts = gTTS(text=text, lang=tts_lang)
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        return fp.getvalue()
-    except Exception: return None
-
-def extract_text_from_docx(file_path):
-    try:
-        doc = docx.Document(file_path)
-        full_text = [para.text for para in doc.paragraphs if para.text.strip()]
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = [cell.text for cell in row.cells]
-                full_text.append(" | ".join(row_text))
-        return "\n".join(full_text)
-    except Exception as e:
-        st.error(f"Word 解析错误: {e}")
-        return ""
-
-def extract_text_from_epub(file_path):
-    try:
-        book = epub.read_epub(file_path)
-        full_text = []
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                full_text.append(soup.get_text())
-        return "\n".join(full_text)
-    except Exception as e:
-        st.error(f"Epub 解析错误: {e}")
-        return ""
-
-def process_and_upload(uploaded_file):
-    file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_src:
-        tmp_src.write(uploaded_file.getvalue())
-        tmp_src_path = tmp_src.name
-
-    final_path = tmp_src_path
-    mime_type = "" 
-
-    try:
-        with st.status(f"📡 正在处理 {file_ext} 文件...", expanded=True) as status:
-            if file_ext in ['.pdf', '.jpg', '.jpeg', '.png', '.webp', '.mp3', '.wav', '.aiff', '.aac', '.ogg', '.flac']:
-                st.write(f"🚀 检测到原生支持格式，正在直传云端...")
-                if file_ext == '.pdf': mime_type = 'application/pdf'
-                elif file_ext in ['.jpg', '.jpeg']: mime_type = 'image/jpeg'
-                elif file_ext == '.png': mime_type = 'image/png'
-            elif file_ext in ['.docx', '.epub', '.txt', '.md', '.py', '.js', '.c', '.json']:
-                st.write(f"🔄 正在解析 {file_ext} 文档结构...")
-                text_content = ""
-                if file_ext == '.docx': text_content = extract_text_from_docx(tmp_src_path)
-                elif file_ext == '.epub': text_content = extract_text_from_epub(tmp_src_path)
-                else:
-                    with open(tmp_src_path, "r", encoding="utf-8", errors='ignore') as f:
-                        text_content = f.read()
-                
-                if not text_content.strip(): raise ValueError(f"文档为空。")
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".txt", mode="w", encoding="utf-8") as tmp_txt:
-                    tmp_txt.write(text_content)
-                    final_path = tmp_txt.name
-                mime_type = "text/plain"
-                st.write("✅ 文档已转换为 AI 可读文本流")
-            else:
-                raise ValueError(f"暂不支持的文件格式: {file_ext}")
-
-            st.write("☁️ 正在上传至 AI 知识库...")
-            if mime_type: myfile = genai.upload_file(final_path, mime_type=mime_type)
-            else: myfile = genai.upload_file(final_path)
-            
-            st.write("🧠 AI 正在构建上下文索引...")
-            while myfile.state.name == "PROCESSING":
-                time.sleep(1)
-                myfile = genai.get_file(myfile.name)
-            
-            if myfile.state.name == "FAILED":
-                status.update(label="❌ 文件处理失败", state="error")
-                raise ValueError("Gemini 无法处理此文件")
-            
+    return metrics.instrument(get_backend(api_key, MODEL_NAME).model(), selected_mode)
+
+@st.cache_resource
+def get_tts_engine():
+    """进程级语音合成引擎 (后台线程池 + LRU，跨会话共享)"""
+    from tts import TTSEngine
+    return TTSEngine()
+
+@st.cache_resource
+def get_opener_pool():
+    """进程级开场白池：每个 (语言, 场景) 预生成几条带语音的开场白，跨会话共享、落盘保留"""
+    from opener_pool import OpenerPool
+    pairs = {(lang, scenario): code for lang, code in COACH_LANGUAGES.items() for scenario in COACH_SCENARIOS}
+    return OpenerPool(pairs, lambda lang, scenario: opener_prompt(lang, scenario, random.choice(OPENER_TONES)), get_tts_engine())
+
+@st.cache_resource
+def get_batch_model(key, model_name):
+    """后台补货用的模型：走批处理优先级，不和页面上的交互请求抢令牌"""
+    return metrics.instrument(create_backend(key, model_name, priority=BATCH).model(), "opener_pool")
+
+def render_speech(text, lang_code):
+    audio_chunks, pending, failed = get_tts_engine().get(text, lang_code)
+    for audio in audio_chunks:
+        st.audio(audio, format="audio/mp3", start_time=0)
+    if pending: st.caption("🔊 语音合成中...")
+    elif failed: st.caption("🔇 语音生成失败，稍后会自动重试")
+
+@st.fragment(run_every=1)
+def poll_speech(text, lang_code):
+    """合成未完成时每秒刷新一次；完成后整页重跑，换成不再轮询的 render_speech"""
+    if not get_tts_engine().get(text, lang_code)[1]: st.rerun()
+    render_speech(text, lang_code)
+
+@st.cache_resource(max_entries=KEY_CACHE_ENTRIES, ttl=KEY_CACHE_TTL)
+def get_upload_cache(key_owner):
+    """上传缓存 (进程级，跨会话共享)，文件归属于 API Key，所以按 Key 分桶"""
+    return new_upload_cache()
+
+def session_connected(sid):
+    """会话的标签页是否仍然连着 (运行时里仍是活跃会话)"""
+    from streamlit.runtime import Runtime
+    return Runtime.exists() and Runtime.instance().is_active_session(sid)
+
+@st.cache_resource
+def get_session_registry():
+    """进程级会话登记：长历史落盘、内存预算、断开且空闲的会话的云端文件回收"""
+    return SessionRegistry(is_connected=session_connected)
+
+def session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+def new_history(name):
+    """会话内的对话历史：内存里只留最近几轮，更早的落盘"""
+    return get_session_registry().history(session_id(), name)
+
+@st.cache_resource
+def get_ingest_pool():
+    """进程级上传线程池：点击后的上传和选中文件后的预上传共用"""
+    return ThreadPoolExecutor(max_workers=INGEST_WORKERS * 4, thread_name_prefix="ingest")
+
+class UploadCancelled(Exception):
+    pass
+
+def upload_key(uploaded_file, image_preset):
+    return (getattr(uploaded_file, "file_id", None) or file_digest(uploaded_file), image_preset)
+
+def start_upload(uploaded_file, image_preset=None):
+    """把上传任务提交到后台线程池，返回 {"future", "events", "cancel"}。
+    工作线程不碰 st.*，进度写进 events 队列；cancel 置位后在下一个阶段边界中止。
+    超时从任务真正开始执行时算起，排队等线程的时间不占用它的时限。"""
+    events, cancel = queue.Queue(), threading.Event()
+    def report(msg):
+        if cancel.is_set(): raise UploadCancelled("文件已更换，预上传已取消")
+        events.put(msg)
+    backend, upload_cache, sid = get_backend(api_key, MODEL_NAME), get_upload_cache(api_key), session_id()
+    name, data = uploaded_file.name, uploaded_file.getvalue()
+    future = get_ingest_pool().submit(
+        lambda: ingest_one(backend, name, data, upload_cache, time.monotonic() + INGEST_DEADLINE, report, image_preset))
+    def track(fut):
+        # 登记到本会话，会话空闲回收时删除没有其他会话在用的云端文件
+        if fut.cancelled() or fut.exception() is not None: return
+        get_session_registry().track_files(sid, backend, upload_cache, [fut.result()])
+    future.add_done_callback(track)
+    return {"future": future, "events": events, "cancel": cancel}
+
+def prefetch_uploads(uploaded_files, image_preset=None, keys=None):
+    """文件一选中就在后台开始上传，点击按钮时 ingest_files 直接接管这些任务。
+    换了文件时取消旧任务：还没开始的不再执行，进行中的在下一个阶段中止；
+    已经传完的留在上传缓存里，换回来时直接复用。keys 默认按 upload_key 计算。"""
+    if not api_key and BACKEND_NAME != "fake": return
+    store = st.session_state.setdefault("prefetched", {})
+    keys = dict(zip(keys or [upload_key(f, image_preset) for f in uploaded_files], uploaded_files))
+    for key in [k for k in store if k not in keys]:
+        entry = store.pop(key)
+        entry["cancel"].set()
+        entry["future"].cancel()
+    for key, f in keys.items():
+        if key not in store: store[key] = start_upload(f, image_preset)
+
+def join_prefetch(uploaded_file, image_preset=None, key=None):
+    """返回该文件仍可用的预上传任务 (进行中或已成功)，没有或已失败时返回 None"""
+    entry = st.session_state.get("prefetched", {}).get(key or upload_key(uploaded_file, image_preset))
+    if entry is None or entry["future"].cancelled(): return None
+    if entry["future"].done() and entry["future"].exception() is not None: return None
+    return entry
+
+def ingest_files(uploaded_files, image_preset=None):
+    """并发上传多个文件，逐个文件的进度写进同一个 st.status。
+    image_preset 为 image_prep.PRESETS 中的档位，图片会先缩放再上传。
+    已有预上传任务的文件直接等待该任务，不重复上传。
+    返回成功挂载的文件 (保持上传顺序)；全部失败时抛出第一个错误。"""
+    results = [None] * len(uploaded_files)
+    errors = [None] * len(uploaded_files)
+
+    label = f"📡 正在处理 {len(uploaded_files)} 个文件..." if len(uploaded_files) > 1 else f"📡 正在处理 {uploaded_files[0].name}..."
+    with st.status(label, expanded=True) as status:
+        rows = [st.empty() for _ in uploaded_files]
+        entries = []
+        for f, row in zip(uploaded_files, rows):
+            entry = join_prefetch(f, image_preset)
+            row.write(f"⚡ `{f.name}` 已在后台预上传..." if entry else f"⏳ `{f.name}` 排队中...")
+            entries.append(entry or start_upload(f, image_preset))
+
+        futures = {entry["future"]: i for i, entry in enumerate(entries)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.2)
+            # 工作线程没有 ScriptRunContext，所有 UI 更新都在这里统一刷新
+            for i, entry in enumerate(entries):
+                while not entry["events"].empty():
+                    rows[i].write(f"`{uploaded_files[i].name}`：{entry['events'].get_nowait()}")
+            for fut in done:
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                    rows[i].write(f"✅ `{uploaded_files[i].name}` 已挂载")
+                except Exception as e:
+                    errors[i] = e
+                    rows[i].write(f"❌ `{uploaded_files[i].name}`：{e}")
+
+        ok_files = [r for r in results if r is not None]
+        if not ok_files:
+            status.update(label="❌ 文件处理失败", state="error")
+            raise next(e for e in errors if e is not None)
+        if len(ok_files) < len(uploaded_files):
+            status.update(label=f"⚠️ 已挂载 {len(ok_files)}/{len(uploaded_files)} 个文件", state="error")
+        else:
             status.update(label="✅ 文件已挂载到 AI 大脑", state="complete")
-            return myfile
-
-    finally:
-        if os.path.exists(tmp_src_path): os.remove(tmp_src_path)
-        if final_path != tmp_src_path and os.path.exists(final_path): os.remove(final_path)
+    return ok_files
+
+def get_meeting_job(uploaded_file):
+    """录音的分段任务，按文件存在会话里 (不能切分的录音记为 None)，失败后再次点击只重试失败的片段"""
+    jobs = st.session_state.setdefault("meeting_jobs", {})
+    key = upload_key(uploaded_file, None)
+    if key not in jobs: jobs[key] = meeting_job(uploaded_file.name, uploaded_file.getvalue())
+    return jobs[key]
+
+def segment_keys(uploaded_file, segments):
+    return [(upload_key(uploaded_file, None), seg.index) for seg in segments]
+
+def prefetch_recording(uploaded_file):
+    """录音一选中就切分，每个片段各自提交一个预上传任务 (各自计时)；不能切分的整段预上传"""
+    job = get_meeting_job(uploaded_file)
+    if job is None: prefetch_uploads([uploaded_file])
+    else: prefetch_uploads(job.pending, keys=segment_keys(uploaded_file, job.pending))
+
+def meeting_contents(model, uploaded_file):
+    """长录音走分段 map-reduce，返回最终合并用的 prompt；录音较短或格式不支持切分时整段上传。"""
+    from meeting_pipeline import fmt_time
+    job = get_meeting_job(uploaded_file)
+    if job is None: return meeting_request(file=process_and_upload(uploaded_file))
+
+    if job.pending:
+        # 选中文件时已按片段在后台预上传，每个 map 任务只等自己那一段，不用等全部传完
+        prefetched = {}
+        for seg, key in zip(job.pending, segment_keys(uploaded_file, job.pending)):
+            entry = join_prefetch(seg, key=key)
+            if entry: prefetched[seg.index] = entry["future"]
+        total = len(job.segments)
+
+        with st.status(f"🎙️ 录音已切成 {total} 段，并发整理中...", expanded=True) as status:
+            progress = st.progress(len(job.notes) / total)
+            def on_done(seg, ok):
+                progress.progress(len(job.notes) / total)
+                detail = "" if ok else f"：{job.errors[seg.index]}"
+                st.write(f"{'✅' if ok else '❌'} 片段 {seg.index + 1} ({fmt_time(seg.start)} - {fmt_time(seg.end)}){detail}")
+
+            backend, upload_cache, sid = get_backend(api_key, MODEL_NAME), get_upload_cache(api_key), session_id()
+            track = lambda f: get_session_registry().track_files(sid, backend, upload_cache, [f])
+            failed = run_meeting_map(job, backend, model, upload_cache, on_done=on_done, on_upload=track, prefetched=prefetched)
+            if failed:
+                status.update(label=f"⚠️ {failed} 段处理失败", state="error")
+                raise ValueError(f"{failed} 个片段失败，再次点击「开始分析」只会重试这些片段")
+            status.update(label="✅ 分段笔记完成，正在合并纪要", state="complete")
+    return meeting_request(job)
+
+def review_contract(model, uploaded_docs):
+    """逐条款并行审查；条款结果按条款哈希缓存，改版合同只重审变化的条款"""
+    from contract_review import CLAUSE_PROMPT
+    clauses = contract_clauses([(f.name, f.getvalue()) for f in uploaded_docs])
+    if not clauses:
+        st.warning("⚠️ 没有识别出可审查的条款 (文档可能只有标题或空白)")
+        return None
+    cache = get_response_cache()
+    keys = {c.digest: make_key(MODEL_NAME, CLAUSE_PROMPT, [c.digest]) for c in clauses}
+    cached = {}
+    if use_response_cache:
+        for digest, key in keys.items():
+            hit = cache.get(key)
+            if hit: cached[digest] = json.loads(hit)
+
+    reused = sum(1 for c in clauses if c.digest in cached)
+    with st.status(f"⚖️ 共 {len(clauses)} 条条款，{reused} 条未变化直接复用", expanded=True) as status:
+        progress = st.progress(reused / len(clauses))
+        done = [reused]
+        def on_batch(batch):
+            done[0] += len(batch)
+            progress.progress(done[0] / len(clauses))
+            st.write(f"✅ 已审查：{batch[0].title} 等 {len(batch)} 条")
+
+        report, fresh = contract_report(model, clauses, cached, on_batch=on_batch)
+        for digest, finding in fresh.items():
+            cache.put(keys[digest], json.dumps(finding, ensure_ascii=False))
+        status.update(label="✅ 逐条审查完成", state="complete")
+
+    render_ai_response(report)
+    return report
+
+def inline_image(uploaded_file, image_preset):
+    blob, image = inline_blob(uploaded_file.name, uploaded_file.getvalue(), image_preset)
+    if image.saved_bytes > 0:
+        st.caption(f"🗜️ 图片已压缩 {format_bytes(image.original_bytes)} → {format_bytes(len(image.data))}")
+    return blob
+
+def process_and_upload(uploaded_file, image_preset=None):
+    return ingest_files([uploaded_file], image_preset)[0]
+
+# 文档问答检索：每次提问只发送 top-k 片段
+DOC_TOP_K = 6
+
+@st.cache_resource(max_entries=8)
+def build_doc_index(named_files):
+    """named_files: ((文件名, 字节), ...)，全部为文本类格式时才建索引，否则返回 None"""
+    from doc_index import BM25Index
+    from epub_extract import extract_chapters
+    named_texts = []
+    for name, file_bytes in named_files:
+        file_ext = os.path.splitext(name)[1].lower()
+        if file_ext not in TEXT_EXTS: return None
+        if file_ext == '.epub':
+            # 保留章节边界，引用时能标出是哪一章
+            named_texts.extend((f"{name} · {ch.title}", ch.text) for ch in extract_chapters(file_bytes))
+        else:
+            named_texts.append((name, extract_text(file_ext, file_bytes)))
+    return BM25Index.from_texts(named_texts)
+
+# 文档上下文缓存：同一组文档的追问引用服务端缓存，不再重复提交整份文件
+DOC_CACHE_TTL = datetime.timedelta(minutes=30)
+DOC_CACHE_REFRESH = datetime.timedelta(minutes=5)
+
+def drop_doc_cache():
+    cache = st.session_state.get("doc_cache")
+    if cache:
+        try:
+            cache.delete()
+        except Exception:
+            pass # 服务端会按 TTL 自行清理
+    st.session_state.doc_cache = None
+    st.session_state.doc_cache_name = None
+
+def get_doc_model():
+    """返回绑定了当前文档缓存的模型；文档太短或模型不支持缓存时退回普通模型。
+    缓存随 current_name 变化重建，临近过期时自动续期。"""
+    model = get_model()
+    if not model: return None
+    state = st.session_state
+    if state.get("doc_cache_name") != state.current_name:
+        drop_doc_cache()
+        try:
+            state.doc_cache = get_backend(api_key, MODEL_NAME).create_cached_content(
+                state.current_doc, DOC_CACHE_TTL, display_name=state.current_name[:128]
+            )
+            if state.doc_cache: get_session_registry().track_cache(session_id(), state.doc_cache)
+        except Exception:
+            state.doc_cache = None # 记住失败，本组文档不再重试
+        state.doc_cache_name = state.current_name
+
+    cache = state.doc_cache
+    if cache is None: return model
+    if cache.expire_time - datetime.datetime.now(datetime.timezone.utc) < DOC_CACHE_REFRESH:
+        try:
+            cache.update(ttl=DOC_CACHE_TTL)
+        except Exception:
+            # 已经过期，下次提问时重建
+            state.doc_cache = None
+            state.doc_cache_name = None
+            return model
+    return metrics.instrument(get_backend(api_key, MODEL_NAME).model_from_cache(cache), selected_mode)
 
 def render_ai_response(response_text):
     st.markdown(f"""<div class="ai-output-box">{response_text}</div>""", unsafe_allow_html=True)
 
+def chat_bubble_html(text, css_class):
+    return f'<div class="chat-container"><div class="chat-bubble {css_class}">{text}</div></div>'
+
+def render_chat_bubble(text, css_class):
+    st.markdown(chat_bubble_html(text, css_class), unsafe_allow_html=True)
+
+# 长对话只渲染最近的若干轮，更早的按页加载；每次 rerun 的渲染量与对话总长度无关
+HISTORY_PAGE = 20
+
+def visible_history(key, history):
+    """返回 (起始下标, 需要渲染的轮次)；更早的轮次折叠成一个「加载更早」按钮"""
+    shown_key = f"{key}_shown"
+    if shown_key not in st.session_state: st.session_state[shown_key] = HISTORY_PAGE
+    hidden = len(history) - st.session_state[shown_key]
+    if hidden > 0:
+        def load_more(): st.session_state[shown_key] += HISTORY_PAGE
+        st.button(f"⬆️ 加载更早的消息 (还有 {hidden} 条)", key=f"{key}_more", on_click=load_more)
+    start = max(0, len(history) - st.session_state[shown_key])
+    return start, history[start:]
+
+def render_chat_history(key, history):
+    """[(role, text)] 历史：整页气泡合成一次 st.markdown。
+    不放进 fragment：本轮新消息画在历史之后，只重跑历史部分会让最新一轮显示两遍"""
+    _, turns = visible_history(key, history)
+    if turns:
+        st.markdown("".join(chat_bubble_html(text, "chat-user" if role == "user" else "chat-ai") for role, text in turns), unsafe_allow_html=True)
+
+def record_latency(ttft, total, streamed):
+    """记录首字延迟 / 总耗时，便于对比流式与非流式"""
+    if "latency_log" not in st.session_state: st.session_state.latency_log = []
+    st.session_state.latency_log.append({"mode": selected_mode, "ttft": ttft, "total": total, "streamed": streamed})
+    st.session_state.latency_log = st.session_state.latency_log[-50:]
+    st.caption(f"⏱️ 首字 {ttft:.2f}s · 总耗时 {total:.2f}s · {'流式' if streamed else '非流式'}")
+
+def show_cache_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) if usage else 0
+    if cached_tokens:
+        st.caption(f"🧊 上下文缓存命中 {cached_tokens:,} tokens / 输入共 {usage.prompt_token_count:,} tokens")
+
+def generate_and_render(model, contents, style="box"):
+    """调用模型并渲染到 ai-output-box (style="box") 或聊天气泡 (style="chat")，返回完整文本"""
+    if style == "chat": render = lambda t: render_chat_bubble(t, "chat-ai")
+    else: render = render_ai_response
+
+    started = time.perf_counter()
+    if not stream_output:
+        response = model.generate_content(contents)
+        text = response.text
+        ttft = time.perf_counter() - started
+        render(text)
+        record_latency(ttft, ttft, streamed=False)
+        show_cache_usage(response)
+        return text
+
+    placeholder = st.empty()
+    text = ""
+    ttft = None
+    response = model.generate_content(contents, stream=True)
+    for chunk in response:
+        try:
+            piece = chunk.text
+        except ValueError:
+            continue # 安全过滤等情况下的空块
+        if ttft is None: ttft = time.perf_counter() - started
+        text += piece
+        with placeholder.container(): render(text + "▌")
+    with placeholder.container(): render(text)
+    total = time.perf_counter() - started
+    record_latency(ttft if ttft is not None else total, total, streamed=True)
+    show_cache_usage(response)
+    return text
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+def file_digest(uploaded_file):
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+def cached_generate_and_render(model, prompt_template, build_contents, file_hashes=(), options=None):
+    """单次生成类模块：先查响应缓存，未命中才调用 build_contents() 组装输入 (上传也在这里发生)。
+    关闭侧边栏开关只跳过读取，新结果仍会写回缓存。"""
+    key = make_key(MODEL_NAME, prompt_template, file_hashes, options)
+    if use_response_cache:
+        cached = get_response_cache().get(key)
+        if cached is not None:
+            render_ai_response(cached)
+            st.caption("⚡ 命中响应缓存")
+            return cached
+    text = generate_and_render(model, build_contents())
+    if text: get_response_cache().put(key, text)
+    return text
+
 # --- 主界面 ---
 
 st.markdown('<div class="main-header">AI 视觉全能助手</div>', unsafe_allow_html=True)
 st.markdown(f'<div class="sub-header">当前激活模块：<span style="color:#4f46e5; font-weight:bold;">{selected_mode}</span></div>', unsafe_allow_html=True)
 
+# 功能模块注册表：侧边栏标签 -> 页面函数，只执行当前选中的模块
+MODE_HANDLERS = {}
+
+def register_mode(*labels):
+    def decorator(handler):
+        for label in labels: MODE_HANDLERS[label] = handler
+        return handler
+    return decorator
+
 # 0. 口语陪练教练 (新增)
-if "口语" in selected_mode:
+@register_mode("🗣️ 口语陪练教练")
+def practice_coach_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     
     # 状态管理
-    if "practice_history" not in st.session_state: st.session_state.practice_history = []
+    if "practice_history" not in st.session_state: st.session_state.practice_history = new_history("practice_history")
+    if "practice_memory" not in st.session_state: st.session_state.practice_memory = ConversationMemory(budget=CHAT_TOKEN_BUDGET)
+    if "practice_audio_open" not in st.session_state: st.session_state.practice_audio_open = set() # 手动展开过语音的轮次
     
     c1, c2, c3 = st.columns(3)
     with c1:
-        target_lang = st.selectbox("🎯 目标语言", ["韩语 (Korean)", "英语 (English)", "日语 (Japanese)", "法语 (French)", "泰语 (Thai)"])
+        target_lang = st.selectbox("🎯 目标语言", list(COACH_LANGUAGES))
     with c2:
-        scenario = st.selectbox("🎬 练习场景", ["日常闲聊", "餐厅点餐", "旅行问路", "初次见面", "商务会议"])
+        scenario = st.selectbox("🎬 练习场景", COACH_SCENARIOS)
     with c3:
         st.write("")
         st.write("")
         if st.button("🔄 重置对话"):
-            st.session_state.practice_history = []
+            st.session_state.practice_history.clear()
+            st.session_state.practice_memory.reset()
+            st.session_state.practice_audio_open = set()
             st.rerun()
             
     # 获取语言代码
-    lang_code_map = {"韩语 (Korean)": "ko-KR", "英语 (English)": "en-US", "日语 (Japanese)": "ja-JP", "法语 (French)": "fr-FR", "泰语 (Thai)": "th-TH"}
-    lang_code = lang_code_map[target_lang]
+    lang_code = COACH_LANGUAGES[target_lang]
     
-    # 初始化开场白
+    # 初始化开场白：优先从预生成的池子里取 (语音也已合成好)，池子空了才现场生成
+    # 池子跨会话共享，补货只用服务端自己的 Key (环境变量 AIASSI_OPENER_KEY 或 Secrets)，
+    # 绝不用访客手动输入的 Key；两者都没有时只发放已落盘的开场白
+    opener_pool = get_opener_pool()
+    pool_key = os.environ.get("AIASSI_OPENER_KEY") or secrets_key
+    if pool_key or BACKEND_NAME == "fake": opener_pool.attach(get_batch_model(pool_key, MODEL_NAME))
+    if not st.session_state.practice_history:
+        opener = opener_pool.take(target_lang, scenario)
+        if opener: st.session_state.practice_history.append({"role": "assistant", "text": opener})
     if not st.session_state.practice_history:
         model = get_model()
         if model:
-            init_prompt = f"你现在是一位地道的{target_lang}母语者。请用{target_lang}向我打招呼，并发起一个关于'{scenario}'的话题。请只输出{target_lang}，不要带翻译。"
+            init_prompt = opener_prompt(target_lang, scenario)
             try:
                 res = model.generate_content(init_prompt)
-                st.session_state.practice_history.append({"role": "assistant", "text": res.text, "audio": None})
+                get_tts_engine().submit(res.text, lang_code)
+                st.session_state.practice_history.append({"role": "assistant", "text": res.text})
             except: pass
 
-    # 显示聊天记录
-    for msg in st.session_state.practice_history:
+    def render_practice_turn(i, msg):
         role = msg["role"]
         text = msg["text"]
         css = "chat-ai" if role == "assistant" else "chat-user"
         
-        st.markdown(f'<div class="chat-container"><div class="chat-bubble {css}">{text}</div></div>', unsafe_allow_html=True)
+        render_chat_bubble(text, css)
         
-        # 只有 AI 的回复才生成语音按钮
+        # 只有 AI 的回复才有语音；最近一轮自动加载，更早的点了才合成 / 挂播放器
         if role == "assistant":
-            # 如果还没有音频缓存，尝试生成
-            if msg.get("audio") is None:
-                audio_data = generate_speech(text, lang_code)
-                msg["audio"] = audio_data # 缓存起来
-            
-            if msg.get("audio"):
-                st.audio(msg["audio"], format="audio/mp3", start_time=0)
+            audio_open = st.session_state.practice_audio_open
+            if i >= len(st.session_state.practice_history) - 2 or i in audio_open:
+                # 合成在后台进行，未完成的用 fragment 定时刷新
+                _, pending, _ = get_tts_engine().get(text, lang_code)
+                if pending: poll_speech(text, lang_code)
+                else: render_speech(text, lang_code)
+            else:
+                st.button("🔊 播放语音", key=f"practice_audio_{i}", on_click=audio_open.add, args=(i,))
             
             # 显示修正建议 (如果有)
             if "correction" in msg and msg["correction"]:
                 st.markdown(f'<div class="correction-box">💡 <strong>语法建议：</strong> {msg["correction"]}</div>', unsafe_allow_html=True)
 
-    # 输入框
+    # 显示聊天记录
+    start, turns = visible_history("practice_history", st.session_state.practice_history)
+    for i, msg in enumerate(turns, start):
+        render_practice_turn(i, msg)
+
+    # 输入框：新消息直接追加渲染在末尾，不再整页 rerun
     user_input = st.chat_input(f"用{target_lang}回复...")
     
     if user_input:
         st.session_state.practice_history.append({"role": "user", "text": user_input})
-        st.rerun()
+        render_chat_bubble(user_input, "chat-user")
 
     # 处理 AI 回复
     if st.session_state.practice_history and st.session_state.practice_history[-1]["role"] == "user":
@@ -319,11 +673,16 @@ if "口语" in selected_mode:
             model = get_model()
             if model:
                 try:
+                    history = st.session_state.practice_history
+                    earlier_turns = MappedView(history, lambda m: (m["role"], m["text"]), len(history) - 1)
+                    history_text = st.session_state.practice_memory.render(earlier_turns, model)
                     # 复杂的 Prompt：既要回复，又要纠错
                     prompt = f"""
                     你是一位{target_lang}口语老师。用户刚刚说了："{last_input}"。
                     当前场景：{scenario}。
                     
+                    {history_text}
+                    
                     任务：
                     1. 像真人一样用{target_lang}自然地回复用户，继续对话。
                     2. 检查用户的输入是否有严重的语法错误或不自然的表达。
@@ -336,7 +695,6 @@ if "口语" in selected_mode:
                     """
                     
                     response = model.generate_content(prompt)
-                    import json
                     try:
                         # 尝试解析 JSON
                         clean_json = response.text.strip()
@@ -350,146 +708,169 @@ if "口语" in selected_mode:
                         reply_text = response.text
                         correction = ""
                     
+                    get_tts_engine().submit(reply_text, lang_code) # 回复一到就开始后台合成
                     st.session_state.practice_history.append({
                         "role": "assistant", 
                         "text": reply_text, 
-                        "correction": correction,
-                        "audio": None # 待生成
+                        "correction": correction
                     })
-                    st.rerun()
+                    render_practice_turn(len(st.session_state.practice_history) - 1, st.session_state.practice_history[-1])
                 except Exception as e: st.error(f"Error: {e}")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # 0.5 你拍我答
-elif "你拍我答" in selected_mode:
+@register_mode("📸 你拍我答 (万能问答)")
+def photo_qa_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     st.info("💡 解题、识物、翻译。支持图片、PDF。")
     tab1, tab2 = st.tabs(["📂 上传文件", "📸 拍照"])
-    with tab1: file_up = st.file_uploader("支持 JPG, PNG, PDF", type=['jpg','png','jpeg', 'pdf'])
+    with tab1: file_ups = st.file_uploader("支持 JPG, PNG, PDF (可多选)", type=['jpg','png','jpeg', 'pdf'], accept_multiple_files=True)
     with tab2: cam_up = st.camera_input("直接拍摄")
-    target = file_up if file_up else cam_up
+    targets = file_ups if file_ups else ([cam_up] if cam_up else [])
     
-    if target:
-        if hasattr(target, 'type') and 'pdf' in target.type:
-            st.markdown(f"📄 **PDF 已就绪**: `{target.name}`")
-        else:
-            st.image(target, width=300)
+    if targets:
+        for target in targets:
+            if hasattr(target, 'type') and 'pdf' in target.type:
+                st.markdown(f"📄 **PDF 已就绪**: `{target.name}`")
+        images = [t for t in targets if not (hasattr(t, 'type') and 'pdf' in t.type)]
+        if images: st.image(images, width=300)
+        prefetch_uploads(targets, "photo_qa") # 用户输入问题时上传已在进行
         
         user_q = st.text_area("✍️ 请输入问题 (留空则默认解读)", height=80)
         if st.button("🚀 开始解答", type="primary"):
             model = get_model()
             if model:
                 try:
-                    gemini_file = process_and_upload(target)
-                    q_prompt = user_q if user_q else "请详细解读这份内容。"
+                    gemini_files = ingest_files(targets, image_preset="photo_qa")
                     with st.spinner("🧠 AI 正在思考..."):
-                        response = model.generate_content([q_prompt, gemini_file])
-                        render_ai_response(response.text)
+                        generate_and_render(model, photo_qa_request(gemini_files, user_q))
                 except Exception as e: st.error(f"Error: {e}")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # 0.8 聊天
-elif "聊天" in selected_mode:
+@register_mode("💬 一起聊天吧 (全知全能)")
+def chat_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-    if "general_chat_history" not in st.session_state: st.session_state.general_chat_history = []
+    if "general_chat_history" not in st.session_state: st.session_state.general_chat_history = new_history("general_chat_history")
+    if "general_memory" not in st.session_state: st.session_state.general_memory = ConversationMemory(budget=CHAT_TOKEN_BUDGET)
     
-    for role, text in st.session_state.general_chat_history:
-        css_class = "chat-user" if role == "user" else "chat-ai"
-        st.markdown(f'<div class="chat-container"><div class="chat-bubble {css_class}">{text}</div></div>', unsafe_allow_html=True)
+    render_chat_history("general_chat_history", st.session_state.general_chat_history)
         
     if query := st.chat_input("和我聊聊吧..."):
         st.session_state.general_chat_history.append(("user", query))
-        st.rerun()
+        render_chat_bubble(query, "chat-user")
 
     if st.session_state.general_chat_history and st.session_state.general_chat_history[-1][0] == "user":
         with st.spinner("AI 正在思考..."):
             model = get_model()
             if model:
                 try:
-                    history_text = "\n".join([f"{r}: {t}" for r, t in st.session_state.general_chat_history[-10:]])
                     system_prompt = "你是一位全知全能、幽默风趣的 AI 助手。严禁讨论色情暴力话题。"
-                    full_prompt = f"{system_prompt}\n\n历史：\n{history_text}\n\nAI 回复："
-                    response = model.generate_content(full_prompt)
-                    st.session_state.general_chat_history.append(("assistant", response.text))
-                    st.rerun()
+                    memory = st.session_state.general_memory
+                    history_text = memory.render(st.session_state.general_chat_history, model, reserved=memory.count(model, system_prompt))
+                    full_prompt = f"{system_prompt}\n\n{history_text}\n\nAI 回复："
+                    reply = generate_and_render(model, full_prompt, style="chat")
+                    st.session_state.general_chat_history.append(("assistant", reply))
                 except Exception as e: st.error(f"回复失败: {e}")
     
     if st.button("🗑️ 清空记录"):
-        st.session_state.general_chat_history = []
+        st.session_state.general_chat_history.clear()
+        st.session_state.general_memory.reset()
         st.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
 
-# 2 & 5. 全库问答 + 合同审查
-elif "全库" in selected_mode or "合同" in selected_mode:
-    is_chat = "全库" in selected_mode
-    
-    if "doc_history" not in st.session_state: st.session_state.doc_history = []
+# 2 & 5. 全库问答 + 合同审查：两个模式共用已挂载的文档
+def document_uploader(supported_types, clear_history=False):
+    """文档上传区：换了文档时重新挂载并建立检索索引，返回当前上传的文件列表"""
+    if "doc_history" not in st.session_state: st.session_state.doc_history = new_history("doc_history")
     if "current_doc" not in st.session_state: st.session_state.current_doc = None
     if "current_name" not in st.session_state: st.session_state.current_name = None
 
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     col1, col2 = st.columns([3, 1])
     with col1:
-        supported_types = ['pdf', 'docx', 'epub', 'txt', 'md']
-        if not is_chat: supported_types.extend(['jpg', 'png', 'jpeg']) 
-        label_text = "📂 上传文档 (支持 PDF, Word .docx, Epub, Txt)"
-        uploaded_doc = st.file_uploader(label_text, type=supported_types)
-    with col2:
-        st.write("") 
-        st.write("") 
-        if st.button("🔄 清空历史"):
-            st.session_state.doc_history = []
-            st.rerun()
+        label_text = "📂 上传文档 (支持 PDF, Word .docx, Epub, Txt，可多选)"
+        uploaded_docs = st.file_uploader(label_text, type=supported_types, accept_multiple_files=True)
+    if clear_history:
+        with col2:
+            st.write("") 
+            st.write("") 
+            if st.button("🔄 清空历史"):
+                st.session_state.doc_history.clear()
+                st.rerun()
 
-    if uploaded_doc:
-        if st.session_state.current_name != uploaded_doc.name:
+    if uploaded_docs:
+        doc_names = ", ".join(f.name for f in uploaded_docs)
+        if st.session_state.current_name != doc_names:
             model = get_model()
             if model:
                 try:
-                    gemini_file = process_and_upload(uploaded_doc)
-                    st.session_state.current_doc = gemini_file
-                    st.session_state.current_name = uploaded_doc.name
-                    st.session_state.doc_history = []
+                    # current_doc 为已挂载文件列表
+                    st.session_state.current_doc = ingest_files(uploaded_docs)
+                    st.session_state.current_name = doc_names
+                    st.session_state.current_doc_hashes = [file_digest(f) for f in uploaded_docs]
+                    st.session_state.doc_index = build_doc_index(tuple((f.name, f.getvalue()) for f in uploaded_docs))
+                    st.session_state.doc_history.clear()
                 except Exception as e: st.error(f"Load Error: {e}")
     st.markdown('</div>', unsafe_allow_html=True)
+    return uploaded_docs
 
-    if st.session_state.current_doc:
-        if not is_chat: # 合同审查
-            if st.button("⚡ 开始深度风险审查", type="primary"):
-                model = get_model()
-                with st.spinner("⚖️ AI 法务正在审阅..."):
-                    prompt = """
-                    你是一位资深法律顾问。请严格审查这份合同文件。
-                    输出一份《法律风险评估报告》，包含：高风险条款预警、权益保障缺失、修改建议(表格)、总体评分。
-                    """
-                    try:
-                        response = model.generate_content([prompt, st.session_state.current_doc])
-                        render_ai_response(response.text)
-                    except Exception as e: st.error(f"Analysis Error: {e}")
+@register_mode("📚 全库文档问答 (PDF/Word/Epub)")
+def doc_chat_page():
+    document_uploader(['pdf', 'docx', 'epub', 'txt', 'md'], clear_history=True)
+    if not st.session_state.current_doc: return
+
+    st.markdown("### 💬 知识库对话")
+    render_chat_history("doc_history", st.session_state.doc_history)
+    
+    if query := st.chat_input("关于这份文档，你想知道什么？"):
+        st.session_state.doc_history.append(("user", query))
+        render_chat_bubble(query, "chat-user")
         
-        else: # 全库问答
-            st.markdown("### 💬 知识库对话")
-            for role, text in st.session_state.doc_history:
-                css_class = "chat-user" if role == "user" else "chat-ai"
-                st.markdown(f'<div class="chat-container"><div class="chat-bubble {css_class}">{text}</div></div>', unsafe_allow_html=True)
-            
-            if query := st.chat_input("关于这份文档，你想知道什么？"):
-                st.session_state.doc_history.append(("user", query))
-                st.rerun()
-                
-            if st.session_state.doc_history and st.session_state.doc_history[-1][0] == "user":
-                last_query = st.session_state.doc_history[-1][1]
-                if len(st.session_state.doc_history) % 2 != 0:
-                    with st.spinner("AI 正在阅读..."):
-                        model = get_model()
-                        try:
-                            response = model.generate_content([st.session_state.current_doc, last_query])
-                            st.session_state.doc_history.append(("assistant", response.text))
-                            st.rerun()
-                        except Exception as e: st.error(f"Chat Error: {e}")
+    if st.session_state.doc_history and st.session_state.doc_history[-1][0] == "user":
+        last_query = st.session_state.doc_history[-1][1]
+        if len(st.session_state.doc_history) % 2 != 0:
+            with st.spinner("AI 正在阅读..."):
+                try:
+                    # 文本类文档先走本地检索，置信度不够再回退整份文件
+                    from doc_index import build_retrieval_prompt
+                    contents = None
+                    doc_index = st.session_state.get("doc_index")
+                    if doc_index:
+                        hits, confidence = doc_index.search(last_query, k=DOC_TOP_K)
+                        if doc_index.is_confident(hits, confidence):
+                            model = get_model()
+                            contents = build_retrieval_prompt(last_query, hits)
+                            st.caption(f"📎 检索命中 {len(hits)} 段 (置信度 {confidence:.0%})")
+                        else:
+                            st.caption("📖 总结类问题或检索置信度低，已回退全文阅读")
+                    if contents is None:
+                        # 全文阅读：文档已在上下文缓存里时只发问题
+                        model = get_doc_model()
+                        contents = last_query if st.session_state.doc_cache else [*st.session_state.current_doc, last_query]
+                    reply = generate_and_render(model, contents, style="chat")
+                    st.session_state.doc_history.append(("assistant", reply))
+                except Exception as e: st.error(f"Chat Error: {e}")
+
+@register_mode("⚖️ 法律合同审查 (Word/PDF)")
+def contract_page():
+    uploaded_docs = document_uploader(['pdf', 'docx', 'epub', 'txt', 'md', 'jpg', 'png', 'jpeg'])
+    if not st.session_state.current_doc: return
+
+    if st.button("⚡ 开始深度风险审查", type="primary"):
+        model = get_model()
+        with st.spinner("⚖️ AI 法务正在审阅..."):
+            try:
+                if clause_reviewable([f.name for f in uploaded_docs]):
+                    review_contract(model, uploaded_docs)
+                else:
+                    cached_generate_and_render(model, CONTRACT_PROMPT, lambda: contract_request(st.session_state.current_doc),
+                                               file_hashes=st.session_state.current_doc_hashes)
+            except Exception as e: st.error(f"Analysis Error: {e}")
 
 # 自动化脚本
-elif "脚本" in selected_mode:
+@register_mode("💻 自动化脚本写手")
+def script_writer_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     st.info("💡 描述需求，AI 将为你编写 Python 自动化脚本。")
     script_requirement = st.text_area("需求描述...", height=150)
@@ -498,104 +879,109 @@ elif "脚本" in selected_mode:
         if model:
             with st.spinner("编写中..."):
                 try:
-                    response = model.generate_content(f"写一个Python脚本：{script_requirement}。要求：健壮、有注释。")
-                    render_ai_response(response.text)
+                    cached_generate_and_render(model, SCRIPT_PROMPT, lambda: script_request(script_requirement),
+                                               options={"requirement": script_requirement})
                 except Exception as e: st.error(f"Error: {e}")
     st.markdown('</div>', unsafe_allow_html=True)
 
-# 医疗 / 会议 / 其他
-else:
+# 会议 / 医疗 / 配文：单个文件，上传或拍照二选一
+def upload_or_camera(label, types, tab_label="📂 上传文件"):
+    tab1, tab2 = st.tabs([tab_label, "📸 拍照"])
+    with tab1: up_file = st.file_uploader(label, type=types)
+    with tab2: cam_file = st.camera_input("拍照")
+    return up_file if up_file else cam_file
+
+@register_mode("🎙️ 会议纪要生成器")
+def meeting_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-    
-    # 区分模式
-    if "会议" in selected_mode:
-        st.info("💡 支持 mp3, wav, m4a, ogg 等音频格式。")
-        up_label = "上传音频"
-        up_types = ['mp3', 'wav', 'm4a', 'ogg', 'flac']
-        prompt_template = "请作为专业的首席会议秘书，根据录音生成一份完美的会议纪要。包含摘要、决策清单、待办事项和详细回顾。"
-    elif "卡路里" in selected_mode:
-        st.info("🍎 AI 营养师准备就绪")
-        up_label = "上传食物图"
-        up_types = ['jpg','png','jpeg']
-        prompt_template = "分析食物，列出热量/营养成分表及建议。"
-    elif "手写" in selected_mode:
-        st.info("📝 OCR 识别引擎准备就绪")
-        up_label = "上传笔记图"
-        up_types = ['jpg','png','jpeg']
-        prompt_template = "OCR 识别，转为电子文本，保留格式。"
-    elif "配文" in selected_mode:
-        st.info("✨ 创意文案引擎准备就绪")
-        up_label = "上传图片"
-        up_types = ['jpg','png','jpeg']
-        pass 
-    elif "医疗" in selected_mode:
-         st.info("🏥 AI 医疗助手准备就绪")
-         up_label = "上传报告/药盒"
-         up_types = ['jpg','png','pdf']
-         pass 
-
-    # 统一上传逻辑
-    if "配文" not in selected_mode and "医疗" not in selected_mode:
-        col1, col2 = st.tabs(["📂 上传文件", "📸 拍照"])
-        with col1: up_file = st.file_uploader(up_label, type=up_types)
-        with col2: cam_file = st.camera_input("拍照")
-        
-        target = up_file if up_file else cam_file
-        
-        if target:
-            if "mp3" not in getattr(target, 'type', '') and "wav" not in getattr(target, 'type', ''):
-                st.image(target, width=400)
-            
-            if st.button("开始分析", type="primary"):
-                model = get_model()
-                if model:
-                    with st.spinner("分析中..."):
-                        try:
-                            g_file = process_and_upload(target)
-                            response = model.generate_content([prompt_template, g_file])
-                            render_ai_response(response.text)
-                        except Exception as e: st.error(f"Error: {e}")
-
-    # 配文
-    elif "配文" in selected_mode:
-        col1, col2 = st.tabs(["📂 上传图片", "📸 拍照"])
-        with col1: up_file = st.file_uploader("上传图片", type=['jpg','png','jpeg'])
-        with col2: cam_file = st.camera_input("拍照")
-        target = up_file if up_file else cam_file
-        
-        if target:
-            st.image(target, width=300)
-            style = st.selectbox("文案风格", ["文艺清新", "幽默搞笑", "扎心语录", "小红书爆款"])
-            if st.button("✨ 生成文案", type="primary"):
-                model = get_model()
-                if model:
-                    with st.spinner("创作中..."):
-                        try:
-                            g_file = Image.open(target)
-                            response = model.generate_content([f"写3条{style}风格的朋友圈文案，带Emoji。", g_file])
-                            render_ai_response(response.text)
-                        except Exception as e: st.error(f"Error: {e}")
-
-    # 医疗
-    elif "医疗" in selected_mode:
-        med_type = st.radio("任务", ["体检解读", "药品识别"], horizontal=True)
-        col1, col2 = st.tabs(["📂 上传", "📸 拍照"])
-        with col1: up_file = st.file_uploader("文件", type=['jpg','png','pdf'])
-        with col2: cam_file = st.camera_input("拍照")
-        target = up_file if up_file else cam_file
+    st.info("💡 支持 mp3, wav, m4a, ogg 等音频格式。")
+    target = upload_or_camera("上传音频", ['mp3', 'wav', 'm4a', 'ogg', 'flac'])
+    if target:
+        if "mp3" not in getattr(target, 'type', '') and "wav" not in getattr(target, 'type', ''):
+            st.image(target, width=400)
+        prefetch_recording(target)
         
-        if target:
-            if st.button("开始分析", type="primary"):
-                model = get_model()
-                if model:
-                    with st.spinner("诊断中..."):
-                        try:
-                            g_file = process_and_upload(target)
-                            prompt = "解读体检报告" if "体检" in med_type else "解读药品说明书"
-                            response = model.generate_content([prompt, g_file])
-                            render_ai_response(response.text)
-                            st.markdown("""<div class="warning-box">⚠️ 结果仅供参考，不作为医疗依据。</div>""", unsafe_allow_html=True)
-                        except Exception as e: st.error(f"Error: {e}")
+        if st.button("开始分析", type="primary"):
+            model = get_model()
+            if model:
+                with st.spinner("分析中..."):
+                    try:
+                        cached_generate_and_render(model, MEETING_PROMPT, lambda: meeting_contents(model, target),
+                                                   file_hashes=[file_digest(target)])
+                    except Exception as e: st.error(f"Error: {e}")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+@register_mode("✨ 社交配文生成")
+def caption_page():
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.info("✨ 创意文案引擎准备就绪")
+    target = upload_or_camera("上传图片", ['jpg','png','jpeg'], "📂 上传图片")
+    if target:
+        st.image(target, width=300)
+        style = st.selectbox("文案风格", CAPTION_STYLES)
+        if st.button("✨ 生成文案", type="primary"):
+            model = get_model()
+            if model:
+                with st.spinner("创作中..."):
+                    try:
+                        cached_generate_and_render(model, CAPTION_PROMPT, lambda: caption_request(inline_image(target, "caption"), style),
+                                                   file_hashes=[file_digest(target)], options={"style": style})
+                    except Exception as e: st.error(f"Error: {e}")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+@register_mode("🏥 医疗健康助手")
+def medical_page():
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.info("🏥 AI 医疗助手准备就绪")
+    med_type = st.radio("任务", list(MEDICAL_PROMPTS), horizontal=True)
+    target = upload_or_camera("文件", ['jpg','png','pdf'], "📂 上传")
+    if target:
+        prefetch_uploads([target], "medical")
+        if st.button("开始分析", type="primary"):
+            model = get_model()
+            if model:
+                with st.spinner("诊断中..."):
+                    try:
+                        cached_generate_and_render(model, MEDICAL_PROMPTS[med_type], lambda: medical_request(process_and_upload(target, "medical"), med_type),
+                                                   file_hashes=[file_digest(target)], options={"med_type": med_type})
+                        st.markdown("""<div class="warning-box">⚠️ 结果仅供参考，不作为医疗依据。</div>""", unsafe_allow_html=True)
+                    except Exception as e: st.error(f"Error: {e}")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+if get_session_registry().revive(session_id()):
+    # 空闲期间本会话的云端文件和文档缓存已被回收：忘掉挂载记录和预上传结果，本次运行重新上传并建缓存
+    for k in ("current_doc", "current_name", "doc_cache", "doc_cache_name"):
+        if k in st.session_state: st.session_state[k] = None
+    for entry in st.session_state.pop("prefetched", {}).values():
+        entry["cancel"].set()
+
+MODE_HANDLERS[selected_mode]()
+
+# --- 延迟统计 (流式 vs 非流式) ---
+if st.session_state.get("latency_log"):
+    with st.sidebar.expander("⏱️ 响应延迟"):
+        for streamed in (True, False):
+            rows = [r for r in st.session_state.latency_log if r["streamed"] == streamed]
+            if rows:
+                avg_ttft = sum(r["ttft"] for r in rows) / len(rows)
+                avg_total = sum(r["total"] for r in rows) / len(rows)
+                st.write(f"{'流式' if streamed else '非流式'} ({len(rows)} 次)：首字 {avg_ttft:.2f}s / 总 {avg_total:.2f}s")
+
+# --- 开发者面板：进程级埋点 (所有会话合计) ---
+metrics.observe("script_run", time.perf_counter() - script_started, selected_mode)
+# 不计入本会话的键：doc_index 来自 cache_resource，由所有会话共享；
+# 云端文件句柄 / 上下文缓存 / 预上传任务只是引用，背后是跨会话共享的 gRPC 客户端，遍历它们既慢又会重复计费
+SESSION_SHARED_KEYS = {"doc_index", "current_doc", "doc_cache", "prefetched"}
+session_bytes = get_session_registry().touch(session_id(), st.session_state, skip=SESSION_SHARED_KEYS)
+if dev_panel:
+    with st.sidebar.expander("🛠️ 阶段耗时 / Token", expanded=True):
+        stages, tokens = metrics.snapshot()
+        if stages: st.dataframe(stages, hide_index=True)
+        if tokens: st.dataframe(tokens, hide_index=True)
+        st.caption(f"调度器：{scheduler_for(api_key).stats}")
+        gauges = metrics.gauges()
+        st.caption(f"本会话内存 {format_bytes(session_bytes)} · 活跃会话 {gauges.get('sessions', 0)} 个，合计 {format_bytes(gauges.get('session_bytes_total', 0))}")
+        st.download_button("⬇️ 导出 Prometheus 指标", metrics.prometheus_text(), file_name="aiassi_metrics.prom", mime="text/plain")
 
 # --- 页脚 ---
 st.markdown("---")
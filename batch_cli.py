@@ -0,0 +1,123 @@
+"""命令行批处理：对一个目录下的文件批量执行某个模块，不启动 Streamlit
+
+    python batch_cli.py contract ./合同 --out results.jsonl --workers 4 --rpm 60
+    python batch_cli.py caption ./照片 --option style=幽默搞笑
+
+每个文件输出一行 JSON (file / sha256 / ok / text 或 error / seconds)。
+已成功的文件哈希记在 <out>.done 里，中断后重跑会跳过，只处理剩下的和失败的。
+--metrics-out 指定文件时，结束后写入 Prometheus 文本格式的阶段耗时和 token 用量
+(可交给 node_exporter 的 textfile collector)。
+API Key 取 --api-key 或环境变量 GEMINI_API_KEY；AIASSI_BACKEND=fake 时离线运行。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from ingest import new_upload_cache
+from llm_backend import DEFAULT_MODEL_NAME, create_backend
+from modes import MODE_EXTS, run_file_mode
+from request_scheduler import BATCH
+
+
+def find_files(root, mode):
+    exts = MODE_EXTS[mode]
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in exts:
+                yield os.path.join(dirpath, name)
+
+
+def load_done(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def parse_options(pairs):
+    options = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise SystemExit(f"--option 需要 key=value 形式: {pair}")
+        options[key] = value
+    return options
+
+
+def process(backend, mode, path, options, upload_cache):
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    start = time.perf_counter()
+    record = {"file": path, "sha256": digest}
+    try:
+        record["text"] = run_file_mode(backend, mode, os.path.basename(path), data, options, upload_cache)
+        record["ok"] = True
+    except Exception as e:
+        record["error"] = str(e)
+        record["ok"] = False
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量执行助手模块")
+    parser.add_argument("mode", choices=sorted(MODE_EXTS))
+    parser.add_argument("input_dir")
+    parser.add_argument("--out", default="results.jsonl", help="JSONL 输出文件 (追加写入)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=None, help="该 Key 每分钟最多发起的模型请求数，0 为不限 (默认取 AIASSI_RPM)")
+    parser.add_argument("--option", action="append", default=[], help="模块选项 key=value，可重复")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--metrics-out", help="结束后写入 Prometheus 指标的文件")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY", ""))
+    args = parser.parse_args(argv)
+
+    done_path = args.out + ".done"
+    done = load_done(done_path)
+    files = list(find_files(args.input_dir, args.mode))
+    if not files:
+        print("没有找到可处理的文件", file=sys.stderr)
+        return 1
+
+    # 批处理优先级低于交互请求，和同进程里的其他调用共用该 Key 的令牌桶
+    backend = create_backend(args.api_key, args.model, priority=BATCH, rpm=args.rpm)
+    options = parse_options(args.option)
+    upload_cache = new_upload_cache()
+
+    todo = []
+    for path in files:
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() not in done:
+                todo.append(path)
+    print(f"共 {len(files)} 个文件，跳过已完成 {len(files) - len(todo)} 个", file=sys.stderr)
+
+    failed = 0
+    with open(args.out, "a", encoding="utf-8") as out, open(done_path, "a", encoding="utf-8") as done_file, \
+            ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(process, backend, args.mode, p, options, upload_cache) for p in todo]
+        for i, fut in enumerate(as_completed(futures), 1):
+            record = fut.result()
+            # 只在主线程写文件，每行写完立即落盘，中断时不留半行
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record["ok"]:
+                done_file.write(record["sha256"] + "\n")
+                done_file.flush()
+            else:
+                failed += 1
+            status = "✓" if record["ok"] else f"✗ {record['error']}"
+            print(f"[{i}/{len(todo)}] {record['file']} {status} ({record['seconds']}s)", file=sys.stderr)
+    if args.metrics_out:
+        with open(args.metrics_out, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus_text())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
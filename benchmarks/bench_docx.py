@@ -0,0 +1,85 @@
+"""DOCX 抽取基准：python-docx 对象遍历 (旧实现) vs docx_stream 流式解析
+
+    python benchmarks/bench_docx.py                  # 生成 250 页合成合同
+    python benchmarks/bench_docx.py --pages 500
+    python benchmarks/bench_docx.py --file 合同.docx  # 用真实文件
+
+对照组需要 python-docx：pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import docx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from docx_stream import docx_to_text  # noqa: E402
+
+CLAUSE = "乙方应在本合同生效之日起三十日内完成交付，逾期每日按合同总价的千分之五向甲方支付违约金。"
+
+
+def legacy_extract(file_path):
+    """改造前 AIASSI.extract_text_from_docx 的实现"""
+    doc = docx.Document(file_path)
+    full_text = [para.text for para in doc.paragraphs if para.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = [cell.text for cell in row.cells]
+            full_text.append(" | ".join(row_text))
+    return "\n".join(full_text)
+
+
+def make_contract(path, pages, cols=8):
+    """每页约 12 段条款，每 5 页插一张带横向合并的宽表"""
+    doc = docx.Document()
+    for page in range(pages):
+        doc.add_heading(f"第 {page + 1} 条", level=2)
+        for i in range(12):
+            doc.add_paragraph(f"{page + 1}.{i + 1} {CLAUSE}")
+        if page % 5 == 4:
+            table = doc.add_table(rows=20, cols=cols)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"R{r}C{c} 付款节点"
+            table.cell(0, 0).merge(table.cell(0, cols - 1))
+        doc.add_page_break()
+    doc.save(path)
+
+
+def measure(fn, path, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = fn(path)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=250)
+    parser.add_argument("--file")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = args.file
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), f"contract_{args.pages}p.docx")
+        make_contract(path, args.pages)
+    print(f"文件: {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+
+    for name, fn in [("python-docx", legacy_extract), ("docx_stream", docx_to_text)]:
+        seconds, peak, chars = measure(fn, path, args.repeat)
+        print(f"{name:<12} 中位耗时 {seconds * 1000:8.1f} ms   峰值内存 {peak / 1024 / 1024:6.1f} MB   {chars} 字")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""离线基准套件：文本抽取、上传流水线、页面 rerun 耗时、冷启动导入耗时
+
+全程不联网：语料现场合成 (docx / epub 直接用 zipfile 写，不依赖 python-docx)，
+上传走 llm_backend.FakeBackend，页面 rerun 用 Streamlit AppTest + AIASSI_BACKEND=fake。
+结果写成 JSON，带上 git 提交号，可以和另一次提交的结果对比：
+
+    python benchmarks/bench_suite.py --out bench/base.json
+    python benchmarks/bench_suite.py --out bench/new.json --compare bench/base.json
+    python benchmarks/bench_suite.py --only extract ingest --sizes small medium
+    python benchmarks/bench_suite.py --only imports
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+# 缓存目录和后端必须在导入项目模块前设好
+os.environ["AIASSI_CACHE_DIR"] = tempfile.mkdtemp(prefix="aiassi_bench_")
+os.environ["AIASSI_BACKEND"] = "fake"
+os.environ.pop("AIASSI_METRICS_LOG", None)
+
+CLAUSE = "乙方应在本合同生效之日起三十日内完成交付，逾期每日按合同总价的千分之五向甲方支付违约金。"
+# 每个档位的段落数 (docx / txt) 和章节数 (epub，每章 40 段)
+SIZES = {
+    "small": {"paragraphs": 200, "chapters": 5},
+    "medium": {"paragraphs": 2000, "chapters": 50},
+    "large": {"paragraphs": 20000, "chapters": 200},
+}
+HISTORY_MODES = {
+    "🗣️ 口语陪练教练": "practice",
+    "💬 一起聊天吧 (全知全能)": "chat",
+    "📚 全库文档问答 (PDF/Word/Epub)": "doc",
+}
+REGRESSION_RATIO = 1.2
+# 冷启动导入基准：页面启动时加载的项目模块 + 各模式按需加载的第三方依赖
+IMPORT_MODULES = [
+    "modes", "ingest", "llm_backend", "response_cache", "chat_memory", "metrics",
+    "tts", "doc_index", "epub_extract", "contract_review", "meeting_pipeline",
+    "streamlit", "google.generativeai", "PIL.Image", "lxml.html", "bs4", "gtts",
+]
+# 组内个别基准因缺少可选依赖跳过时记在这里 (基准名 -> 原因)，整组跳过的记在 main 里
+SKIPPED = {}
+
+
+# ---------------- 语料生成 ----------------
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+
+def make_docx(paragraphs, cols=6):
+    """条款段落 + 每 60 段一张 20 行的表格，返回 docx 字节"""
+    body = []
+    for i in range(paragraphs):
+        body.append(f"<w:p><w:r><w:t>{i + 1}. {escape(CLAUSE)}</w:t></w:r></w:p>")
+        if i % 60 == 59:
+            rows = "".join(
+                "<w:tr>" + "".join(f"<w:tc><w:p><w:r><w:t>R{r}C{c} 付款节点</w:t></w:r></w:p></w:tc>" for c in range(cols)) + "</w:tr>"
+                for r in range(20)
+            )
+            body.append(f"<w:tbl>{rows}</w:tbl>")
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                + "".join(body) + "</w:body></w:document>")
+    return _zip([("[Content_Types].xml", DOCX_CONTENT_TYPES), ("_rels/.rels", DOCX_RELS), ("word/document.xml", document)])
+
+
+def make_epub(chapters, paragraphs_per_chapter=40):
+    container = ('<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                 '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+    manifest = "".join(f'<item id="ch{i}" href="ch{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(chapters))
+    spine = "".join(f'<itemref idref="ch{i}"/>' for i in range(chapters))
+    opf = (f'<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+           f"<manifest>{manifest}</manifest><spine>{spine}</spine></package>")
+    files = [("mimetype", "application/epub+zip"), ("META-INF/container.xml", container), ("OEBPS/content.opf", opf)]
+    for i in range(chapters):
+        paras = "".join(f"<p>{j + 1}. {escape(CLAUSE)}</p>" for j in range(paragraphs_per_chapter))
+        files.append((f"OEBPS/ch{i}.xhtml", f'<html xmlns="http://www.w3.org/1999/xhtml"><body><h1>第{i + 1}章</h1>{paras}</body></html>'))
+    return _zip(files)
+
+
+def make_txt(paragraphs):
+    return "\n".join(f"{i + 1}. {CLAUSE}" for i in range(paragraphs)).encode("utf-8")
+
+
+def _zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files:
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
+def make_corpus(size):
+    spec = SIZES[size]
+    return {
+        "docx": make_docx(spec["paragraphs"]),
+        "epub": make_epub(spec["chapters"]),
+        "txt": make_txt(spec["paragraphs"]),
+    }
+
+
+# ---------------- 测量 ----------------
+
+def measure(fn, repeat, setup=None):
+    """返回 {median_s, min_s, peak_mb}；setup 在每次计时前执行 (不计入耗时)"""
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    if setup: setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": round(statistics.median(times), 5), "min_s": round(min(times), 5), "peak_mb": round(peak / 1024 / 1024, 2)}
+
+
+def clear_epub_cache():
+    import epub_extract
+    shutil.rmtree(epub_extract.CACHE_DIR, ignore_errors=True)
+
+
+def missing_epub_parser():
+    """EPUB 章节解析需要 lxml 或 beautifulsoup4；都没有时返回跳过原因。
+    ingest 会把 ImportError 包成 ValueError，所以要在跑之前检查"""
+    if importlib.util.find_spec("lxml") or importlib.util.find_spec("bs4"):
+        return None
+    return "No module named 'lxml' or 'bs4'"
+
+
+def bench_extract(sizes, repeat):
+    from ingest import extract_text_from_docx, extract_text_from_epub
+
+    epub_missing = missing_epub_parser()
+    if epub_missing: SKIPPED["extract_epub"] = epub_missing
+    for size in sizes:
+        corpus = make_corpus(size)
+        yield "extract_docx", size, len(corpus["docx"]), measure(lambda: extract_text_from_docx(io.BytesIO(corpus["docx"])), repeat)
+        if epub_missing:
+            continue
+        yield "extract_epub_cold", size, len(corpus["epub"]), measure(lambda: extract_text_from_epub(corpus["epub"]), repeat, clear_epub_cache)
+        extract_text_from_epub(corpus["epub"])
+        yield "extract_epub_warm", size, len(corpus["epub"]), measure(lambda: extract_text_from_epub(corpus["epub"]), repeat)
+
+
+def bench_ingest(sizes, repeat):
+    """process_and_upload 背后的 ingest_one：抽取 + 上传 + 就绪轮询，对假后端计时，只测本地开销"""
+    from ingest import ingest_one, new_upload_cache
+    from llm_backend import FakeBackend
+
+    backend = FakeBackend()
+    quiet = lambda msg: None
+    epub_missing = missing_epub_parser()
+    if epub_missing: SKIPPED["ingest_epub"] = epub_missing
+    for size in sizes:
+        for ext, data in make_corpus(size).items():
+            if ext == "epub" and epub_missing:
+                continue
+            name = f"bench_{size}.{ext}"
+            run = lambda: ingest_one(backend, name, data, new_upload_cache(), time.monotonic() + 60, quiet)
+            yield f"ingest_{ext}", size, len(data), measure(run, repeat, clear_epub_cache)
+            cache = new_upload_cache()
+            ingest_one(backend, name, data, cache, time.monotonic() + 60, quiet)
+            hit = lambda: ingest_one(backend, name, data, cache, time.monotonic() + 60, quiet)
+            yield f"ingest_{ext}_cached", size, len(data), measure(hit, repeat)
+
+
+def history_state(kind, turns):
+    reply = "好的，我们继续。" + CLAUSE
+    if kind == "practice":
+        return {"practice_history": [{"role": "user" if i % 2 else "assistant", "text": f"{i} {reply}"} for i in range(turns)]}
+    if kind == "chat":
+        return {"general_chat_history": [("user" if i % 2 == 0 else "assistant", f"{i} {reply}") for i in range(turns)]}
+    return {"doc_history": [("user" if i % 2 == 0 else "assistant", f"{i} {reply}") for i in range(turns)],
+            "current_doc": ["files/bench"], "current_name": "bench.txt", "current_doc_hashes": ["bench"]}
+
+
+def bench_rerun(turns_list, repeat):
+    """各模块在长历史下的整页 rerun 耗时 (Streamlit AppTest)"""
+    from streamlit.testing.v1 import AppTest
+
+    for mode, kind in HISTORY_MODES.items():
+        for turns in turns_list:
+            at = AppTest.from_file(os.path.join(ROOT, "AIASSI.py"), default_timeout=120)
+            for key, value in history_state(kind, turns).items():
+                at.session_state[key] = value
+            at.run()
+            at.sidebar.radio[0].set_value(mode).run()
+            if at.exception:
+                raise RuntimeError(f"{mode}: {at.exception[0].message}")
+            yield f"rerun_{kind}", f"{turns}_turns", turns, measure(at.run, repeat)
+
+
+def import_seconds(module):
+    """新进程里 python -X importtime 报告的累计导入耗时 (秒)；模块未安装时返回 None"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    for line in reversed(proc.stderr.splitlines()):
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1e6
+    return None
+
+
+def bench_imports(repeat):
+    for module in IMPORT_MODULES:
+        times = [import_seconds(module) for _ in range(repeat)]
+        if None in times:
+            print(f"跳过导入基准 {module}：未安装")
+            continue
+        yield "import", module, 0, {"median_s": round(statistics.median(times), 5), "min_s": round(min(times), 5), "peak_mb": 0.0}
+
+
+# ---------------- 结果 ----------------
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\n对比 {baseline_path}：")
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if not old or not old["median_s"]:
+            continue
+        ratio = r["median_s"] / old["median_s"]
+        flag = "  ⚠️ 回退" if ratio > threshold else ""
+        regressions += ratio > threshold
+        print(f"{r['name']:<22} {r['size']:<10} {old['median_s'] * 1000:9.1f} ms → {r['median_s'] * 1000:9.1f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=["extract", "ingest", "rerun", "imports"],
+                        default=["extract", "ingest", "rerun", "imports"])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--turns", nargs="+", type=int, default=[20, 200], help="rerun 基准的历史轮数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="基线结果 JSON，中位耗时超过基线 --threshold 倍时返回非零")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args()
+
+    suites = {
+        "extract": lambda: bench_extract(args.sizes, args.repeat),
+        "ingest": lambda: bench_ingest(args.sizes, args.repeat),
+        "rerun": lambda: bench_rerun(args.turns, args.repeat),
+        "imports": lambda: bench_imports(args.repeat),
+    }
+    results, skipped = [], {}
+    for suite in args.only:
+        try:
+            for name, size, input_size, stats in suites[suite]():
+                results.append({"name": name, "size": size, "input": input_size, **stats})
+                print(f"{name:<22} {size:<10} {stats['median_s'] * 1000:9.1f} ms   峰值内存 {stats['peak_mb']:7.1f} MB")
+        except ImportError as e:
+            skipped[suite] = str(e)  # 缺少可选依赖 (如 streamlit) 时跳过整组，其余照常
+            print(f"跳过 {suite}：{e}")
+    for name, reason in SKIPPED.items():
+        skipped[name] = reason
+        print(f"跳过 {name}：{reason}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "skipped": skipped,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.out}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""文档问答检索的离线检查：用现场合成的样书验证分块长度和 top-k 命中
+
+    python -m pytest -q benchmarks/test_doc_index.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doc_index import BM25Index, chunk_text
+
+FILLER = "雨一直下，街上的行人撑着伞匆匆走过，谁也没有停下脚步。"
+# 每章埋一条只在这一章出现的情节，问题按情节提问
+PLOTS = [
+    ("林默在旧书店里找到了祖父留下的航海日志。", "林默在哪里找到了航海日志？"),
+    ("苏晴把那枚铜钥匙藏进了灯塔地下室的砖缝里。", "苏晴把铜钥匙藏在哪里？"),
+    ("老船长说，三十年前的风暴吞没了整支捕鲸船队。", "捕鲸船队是被什么吞没的？"),
+    ("The lighthouse keeper kept a diary written in cipher.", "What was the lighthouse keeper's diary written in?"),
+    ("最后，林默驾着修好的帆船驶向了北方的冰海。", "林默最后驾着帆船驶向了哪里？"),
+]
+
+
+def sample_book(paragraphs_per_chapter=30):
+    """每章若干段填充文字，情节段落放在章节中间；第 3 章带一个不分段的超长段落"""
+    chapters = []
+    for n, (plot, _) in enumerate(PLOTS, 1):
+        paras = [f"第 {n} 章"] + [FILLER * 3] * paragraphs_per_chapter
+        paras.insert(paragraphs_per_chapter // 2, plot)
+        if n == 3:
+            paras.append(FILLER * 200)
+        chapters.append("\n".join(paras))
+    return "\n\n".join(chapters)
+
+
+def test_chunk_lengths():
+    for text in (sample_book(), "长" * 5000, "短句\n" + "长" * 5000 + "\n结尾"):
+        chunks = chunk_text(text, chunk_size=800, overlap=120)
+        lengths = [len(c.text) for c in chunks]
+        assert max(lengths) <= 800, lengths
+        # 除最后一块外都应接近满块，不会出现只有重叠部分的碎块
+        assert min(lengths[:-1]) > 800 - 120, lengths
+        assert [c.id for c in chunks] == list(range(len(chunks)))
+
+
+def test_long_line_keeps_every_character():
+    chunks = chunk_text("".join(chr(0x4e00 + i % 500) for i in range(5000)), chunk_size=800, overlap=120)
+    assert [len(c.text) for c in chunks] == [800] * 7 + [240]
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert cur.text[:120] == prev.text[-120:]
+    assert chunks[0].text + "".join(c.text[120:] for c in chunks[1:]) == "".join(chr(0x4e00 + i % 500) for i in range(5000))
+
+
+def test_top_k_retrieval():
+    index = BM25Index.from_texts([("样书.txt", sample_book())])
+    for plot, question in PLOTS:
+        hits, confidence = index.search(question, k=3)
+        assert any(plot in chunk.text for _, chunk in hits), question
+        assert index.is_confident(hits, confidence), (question, confidence)
+
+
+def test_low_confidence_falls_back():
+    index = BM25Index.from_texts([("样书.txt", sample_book())])
+    for question in ("请总结一下全书的主要内容", "量子计算机的纠错码怎么设计？"):
+        hits, confidence = index.search(question, k=3)
+        assert not index.is_confident(hits, confidence), (question, confidence)
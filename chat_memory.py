@@ -0,0 +1,84 @@
+"""按 token 预算管理的对话记忆 (聊天 / 口语陪练共用)
+
+最近的轮次原样保留；超出预算时把最旧的轮次增量折叠进滚动摘要，
+已折叠的部分不再重复总结，每轮的 prompt 长度因此保持平稳。
+model 只需要提供 count_tokens(text).total_tokens 和 generate_content(prompt).text。
+"""
+
+SUMMARY_PROMPT = """请把下面新增的对话内容合并进已有摘要，输出更新后的摘要。
+要求：保留人物、事实、偏好、未完成的话题等后续对话需要的信息，不超过 300 字，只输出摘要本身。
+
+已有摘要：
+{summary}
+
+新增对话：
+{turns}
+"""
+
+
+def format_turns(turns):
+    return "\n".join(f"{role}: {text}" for role, text in turns)
+
+
+class ConversationMemory:
+    def __init__(self, budget=6000, keep_recent=2, low_watermark=0.6):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        # 一旦超预算就一次性折叠到 budget * low_watermark 以下，避免每轮都调用一次总结
+        self.low_watermark = low_watermark
+        self.summary = ""
+        self.summarized_upto = 0  # history 中已折叠进摘要的轮数
+        self.token_counts = {}
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_upto = 0
+        self.token_counts = {}
+
+    def count(self, model, text):
+        if not text:
+            return 0
+        if text not in self.token_counts:
+            try:
+                self.token_counts[text] = model.count_tokens(text).total_tokens
+            except Exception:
+                self.token_counts[text] = len(text) // 2 + 1  # 计数接口失败时粗略估算
+        return self.token_counts[text]
+
+    def context(self, history, model, reserved=0):
+        """history: [(role, text)]；reserved 为系统提示词等固定部分占用的 token。
+        返回 (滚动摘要, 原样保留的最近轮次)。"""
+        if len(history) < self.summarized_upto:
+            self.reset()  # 历史被清空过
+        turns = list(history[self.summarized_upto:])
+        total = reserved + self.count(model, self.summary) + sum(self.count(model, f"{r}: {t}") for r, t in turns)
+
+        n_evict = 0
+        target = self.budget if total <= self.budget else self.budget * self.low_watermark
+        while total > target and len(turns) - n_evict > self.keep_recent:
+            role, text = turns[n_evict]
+            total -= self.count(model, f"{role}: {text}")
+            n_evict += 1
+
+        if n_evict:
+            evicted = turns[:n_evict]
+            self.token_counts.pop(self.summary, None)
+            try:
+                self.summary = model.generate_content(
+                    SUMMARY_PROMPT.format(summary=self.summary or "(无)", turns=format_turns(evicted))
+                ).text.strip()
+            except Exception:
+                # 总结失败时把原文截断后拼进摘要，不丢上下文也不阻塞本轮回复
+                self.summary = (self.summary + "\n" + format_turns(evicted))[-2000:]
+            self.summarized_upto += n_evict
+            for role, text in evicted:
+                self.token_counts.pop(f"{role}: {text}", None)
+        return self.summary, turns[n_evict:]
+
+    def render(self, history, model, reserved=0):
+        summary, recent = self.context(history, model, reserved)
+        parts = []
+        if summary:
+            parts.append(f"更早的对话摘要：\n{summary}")
+        parts.append(f"历史：\n{format_turns(recent)}")
+        return "\n\n".join(parts)
@@ -0,0 +1,175 @@
+"""按条款切分的并行合同审查
+
+把抽取出的合同文本切成编号条款，分批并发审查，再在本地合并成
+《法律风险评估报告》的各个部分。单条款结果按条款文本哈希缓存，
+同一份合同改版后重新上传时，没变的条款直接复用上次结果。
+"""
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+# 条款标题：第X条 / 一、 / 1. 1、 / (一)
+CLAUSE_HEAD_RE = re.compile(
+    r"^\s*(第[一二三四五六七八九十百零〇\d]+条|[一二三四五六七八九十]+、|\d{1,3}[\.、](?!\d)|[（(][一二三四五六七八九十]+[)）])"
+)
+BATCH_CHARS = 6000
+FALLBACK_CLAUSE_CHARS = 1500
+REVIEW_CONCURRENCY = 4
+RISK_LEVELS = ("高", "中", "低", "无")
+
+CLAUSE_PROMPT = """你是一位资深法律顾问，正在逐条审查一份合同。下面是其中若干条款，每条以 [条款编号] 开头。
+请对每一条给出审查意见，只输出 JSON 数组，每个元素形如：
+{"no": 条款编号, "level": "高|中|低|无", "risk": "风险说明，没有则留空", "suggestion": "修改建议，没有则留空"}
+
+"""
+
+MISSING_PROMPT = """你是一位资深法律顾问。下面是一份合同全部条款的标题/开头，
+请指出这份合同缺失了哪些应有的权益保障条款 (如违约责任、保密、争议解决、知识产权、解除条件等)，
+用 Markdown 列表输出，每条一句话说明缺失的影响。没有缺失就输出「未发现明显缺失」。
+
+"""
+
+
+@dataclass
+class Clause:
+    no: int
+    text: str
+
+    @property
+    def digest(self):
+        return hashlib.sha256(" ".join(self.text.split()).encode("utf-8")).hexdigest()
+
+    @property
+    def title(self):
+        return self.text.strip().splitlines()[0][:40]
+
+
+def segment_clauses(text):
+    """按条款标题切分；整篇没有可识别的标题时按段落拼成约 1500 字的块"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    clauses, buf = [], []
+    for line in lines:
+        if CLAUSE_HEAD_RE.match(line) and buf:
+            clauses.append("\n".join(buf))
+            buf = []
+        buf.append(line)
+    if buf:
+        clauses.append("\n".join(buf))
+
+    if len(clauses) <= 1:
+        clauses, chunk = [], ""
+        for line in lines:
+            if chunk and len(chunk) + len(line) > FALLBACK_CLAUSE_CHARS:
+                clauses.append(chunk)
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line
+        if chunk:
+            clauses.append(chunk)
+    return [Clause(i + 1, c) for i, c in enumerate(clauses)]
+
+
+def batch_clauses(clauses, max_chars=BATCH_CHARS):
+    batches, batch, size = [], [], 0
+    for clause in clauses:
+        if batch and size + len(clause.text) > max_chars:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(clause)
+        size += len(clause.text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_findings(raw):
+    text = raw.strip()
+    if "```" in text:
+        text = text.split("```")[1]
+        text = text[4:] if text.startswith("json") else text
+    start, end = text.find("["), text.rfind("]")
+    items = json.loads(text[start:end + 1])
+    findings = {}
+    for item in items:
+        try:
+            no = int(item["no"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        level = item.get("level", "无")
+        findings[no] = {
+            "level": level if level in RISK_LEVELS else "无",
+            "risk": item.get("risk", "") or "",
+            "suggestion": item.get("suggestion", "") or "",
+        }
+    return findings
+
+
+def review_batch(model, batch):
+    """返回 {条款编号: 审查意见}；模型漏掉的条款不在结果里，不会被缓存"""
+    body = "\n\n".join(f"[{c.no}] {c.text}" for c in batch)
+    return parse_findings(model.generate_content(CLAUSE_PROMPT + body).text)
+
+
+def review_clauses(model, clauses, cached, max_workers=REVIEW_CONCURRENCY, on_batch=None):
+    """cached: {条款哈希: 审查意见}，命中的条款跳过。
+    返回 ({条款编号: 审查意见}, 缺失保障 Markdown, 本次新审查的 {条款哈希: 审查意见})。"""
+    findings = {c.no: cached[c.digest] for c in clauses if c.digest in cached}
+    todo = [c for c in clauses if c.digest not in cached]
+    fresh = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # 缺失条款需要通篇视角，和分批审查同时进行
+        headings = "\n".join(f"{c.no}. {c.title}" for c in clauses)
+        missing_future = pool.submit(lambda: model.generate_content(MISSING_PROMPT + headings).text)
+        futures = [(pool.submit(review_batch, model, batch), batch) for batch in batch_clauses(todo)]
+        for future, batch in futures:
+            try:
+                result = future.result()
+            except Exception:
+                result = {}  # 这一批失败，条款会在报告末尾列为未审查
+            for clause in batch:
+                if clause.no in result:
+                    findings[clause.no] = result[clause.no]
+                    fresh[clause.digest] = result[clause.no]
+            if on_batch:
+                on_batch(batch)
+        try:
+            missing = missing_future.result()
+        except Exception as e:
+            missing = f"缺失条款检查失败：{e}"
+    return findings, missing, fresh
+
+
+def score(findings):
+    high = sum(1 for f in findings.values() if f["level"] == "高")
+    medium = sum(1 for f in findings.values() if f["level"] == "中")
+    low = sum(1 for f in findings.values() if f["level"] == "低")
+    return max(0, 100 - 15 * high - 6 * medium - 2 * low)
+
+
+def build_report(clauses, findings, missing):
+    by_no = {c.no: c for c in clauses}
+    risky = [(no, f) for no, f in sorted(findings.items()) if f["level"] in ("高", "中", "低")]
+
+    high = [f"- **{by_no[no].title}**：{f['risk']}" for no, f in risky if f["level"] == "高"]
+    rows = [
+        f"| {by_no[no].title} | {f['level']} | {f['risk']} | {f['suggestion']} |".replace("\n", " ")
+        for no, f in risky if f["suggestion"]
+    ]
+    unreviewed = [c.title for c in clauses if c.no not in findings]
+
+    parts = [
+        "## 《法律风险评估报告》",
+        "### 一、高风险条款预警",
+        "\n".join(high) or "未发现高风险条款。",
+        "### 二、权益保障缺失",
+        missing.strip(),
+        "### 三、修改建议",
+        "| 条款 | 风险等级 | 问题 | 修改建议 |\n|---|---|---|---|\n" + "\n".join(rows) if rows else "暂无修改建议。",
+        "### 四、总体评分",
+        f"**{score(findings)} / 100** (共 {len(clauses)} 条，高风险 {len(high)} 条)",
+    ]
+    if unreviewed:
+        parts.append("> ⚠️ 以下条款未能完成审查：" + "、".join(unreviewed))
+    return "\n\n".join(parts)
@@ -0,0 +1,181 @@
+"""本地分块 BM25 检索 (全库文档问答用)
+
+纯标准库实现，不依赖 Streamlit / Gemini，可离线单独运行：
+    python doc_index.py book.txt "主角最后去了哪里？"
+"""
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+# 中日韩字符按单字 + 相邻二元组切分，其余按字母数字词切分
+CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+WORD_RE = re.compile(r"[a-z0-9]+(?:['_-][a-z0-9]+)*")
+
+# 检索置信度 = min(最佳片段的归一化 BM25 得分, 查询词覆盖率)，低于阈值时回退全文。
+# 中文单字几乎出现在每一块里，只用二元组和词计算覆盖率
+MIN_CONFIDENCE = 0.4
+# 总结 / 概括类问题需要通读全文，直接回退，不走片段检索
+GLOBAL_QUERY_RE = re.compile(
+    r"总结|概括|归纳|梗概|大意|摘要|全文|全书|整本|整篇|通篇|主要内容|中心思想|主旨|讲了什么|讲的是什么|写了什么"
+    r"|summar|overview|tl;?dr|whole (?:book|document|text)|entire (?:book|document|text)",
+    re.IGNORECASE,
+)
+# 疑问词在正文里很少出现，计算置信度前先去掉，免得拉低得分
+QUESTION_RE = re.compile(r"请问|为什么|为何|做什么|干什么|是什么|什么|哪里|哪儿|哪个|怎么样|怎么|怎样|如何|是否|多少|一下|吗|呢|吧|谁")
+
+
+@dataclass
+class Chunk:
+    id: int
+    source: str
+    text: str
+
+
+def tokenize(text):
+    text = text.lower()
+    tokens = []
+    pos = 0
+    for m in CJK_RE.finditer(text):
+        tokens.extend(WORD_RE.findall(text[pos:m.start()]))
+        run = m.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        pos = m.end()
+    tokens.extend(WORD_RE.findall(text[pos:]))
+    return tokens
+
+
+def key_terms(query):
+    """计算置信度用的查询词：去掉疑问词和中文单字，只保留二元组和词"""
+    tokens = set(tokenize(QUESTION_RE.sub(" ", query)))
+    terms = {t for t in tokens if not (len(t) == 1 and CJK_RE.match(t))}
+    return terms or tokens
+
+
+def is_global_query(query):
+    return bool(GLOBAL_QUERY_RE.search(query))
+
+
+def chunk_text(text, source="", chunk_size=800, overlap=120, start_id=0):
+    """按段落拼成不超过 chunk_size 字的块，超长段落硬切。
+    每块以前一块末尾的 overlap 字开头；重叠部分只作为下一块的前缀，不会单独成块。"""
+    overlap = min(overlap, chunk_size // 2)
+    chunks = []
+    buf, fresh = "", False  # fresh：buf 里除了重叠前缀还有没输出过的内容
+
+    def flush():
+        nonlocal buf, fresh
+        chunks.append(buf)
+        buf, fresh = (buf[-overlap:] if overlap else ""), False
+
+    for para in (p.strip() for p in text.split("\n")):
+        if not para:
+            continue
+        sep = "\n" if buf else ""
+        # 放得进一整块的段落不拆开；超长段落反正要切，先填满当前块
+        if fresh and len(para) <= chunk_size and len(buf) + len(sep) + len(para) > chunk_size:
+            flush()
+            # 重叠前缀让出位置，保证整段放进下一块
+            keep = chunk_size - len(para) - 1
+            buf = buf[-keep:] if keep > 0 else ""
+            sep = "\n" if buf else ""
+        while len(buf) + len(sep) + len(para) > chunk_size:
+            room = chunk_size - len(buf) - len(sep)
+            buf, fresh, para = buf + sep + para[:room], True, para[room:]
+            flush()
+            sep = ""  # 同一段落接着切，不加换行
+        buf, fresh = buf + sep + para, True
+    if fresh:
+        chunks.append(buf)
+    return [Chunk(start_id + i, source, c) for i, c in enumerate(chunks)]
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # token -> [(chunk_idx, tf)]
+        self.lengths = []
+        for idx, chunk in enumerate(chunks):
+            tf = Counter(tokenize(chunk.text))
+            self.lengths.append(sum(tf.values()))
+            for tok, n in tf.items():
+                self.postings[tok].append((idx, n))
+        self.avg_len = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        n_docs = len(chunks)
+        self.idf = {tok: math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5)) for tok, p in self.postings.items()}
+
+    @classmethod
+    def from_texts(cls, named_texts, **chunk_kwargs):
+        """named_texts: [(来源名, 全文)]"""
+        chunks = []
+        for source, text in named_texts:
+            chunks.extend(chunk_text(text, source, start_id=len(chunks), **chunk_kwargs))
+        return cls(chunks)
+
+    def search(self, query, k=5):
+        """返回 (hits, confidence)：hits 为 [(score, Chunk)]；confidence 取以下两者的较小值：
+        - 命中片段里最高的查询词得分 / 理想得分 (每个查询词在一个平均长度的块里各出现一次)，
+          语料里没有的词按最大 idf 计入理想得分
+        - 查询词被命中片段覆盖的比例
+        查询词见 key_terms；总结类问题 confidence 为 0。"""
+        q_tokens = set(tokenize(query))
+        if not q_tokens or not self.chunks:
+            return [], 0.0
+        scores = defaultdict(float)
+        for tok in q_tokens:
+            idf = self.idf.get(tok)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[tok]:
+                norm = 1 - self.b + self.b * self.lengths[idx] / self.avg_len
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        top = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        hits = [(score, self.chunks[idx]) for idx, score in top]
+
+        if not hits or is_global_query(query):
+            return hits, 0.0
+
+        terms = key_terms(query)
+        if not terms:
+            return hits, 0.0
+        max_idf = math.log(1 + (len(self.chunks) + 0.5) / 0.5)
+        ideal = sum(self.idf.get(tok, max_idf) for tok in terms)
+        best = 0.0
+        hit_tokens = set()
+        for _, chunk in hits:
+            tf = Counter(tokenize(chunk.text))
+            hit_tokens.update(tf)
+            best = max(best, sum(self.idf[tok] for tok in terms if tf[tok]))
+        relevance = min(1.0, best / ideal)
+        coverage = len(terms & hit_tokens) / len(terms)
+        return hits, min(relevance, coverage)
+
+    def is_confident(self, hits, confidence):
+        return bool(hits) and confidence >= MIN_CONFIDENCE
+
+
+def build_retrieval_prompt(query, hits):
+    """把命中片段编号后拼进 prompt，要求模型用 [编号] 标注引用"""
+    passages = "\n\n".join(f"[{i}] 《{c.source}》第 {c.id + 1} 段：\n{c.text}" for i, (_, c) in enumerate(hits, 1))
+    return (
+        "以下是从文档中检索到的相关片段。请仅依据这些片段回答问题，"
+        "在引用处用 [编号] 标注出处；如果片段不足以回答，请直接说明。\n\n"
+        f"{passages}\n\n问题：{query}"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法: python doc_index.py <文本文件> <问题> [top_k]")
+        sys.exit(1)
+    with open(sys.argv[1], encoding="utf-8", errors="ignore") as f:
+        index = BM25Index.from_texts([(sys.argv[1], f.read())])
+    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    hits, confidence = index.search(sys.argv[2], k=top_k)
+    print(f"{len(index.chunks)} 个分块，置信度 {confidence:.0%}，{'可用' if index.is_confident(hits, confidence) else '置信度低，回退全文'}")
+    for score, chunk in hits:
+        print(f"--- #{chunk.id + 1} score={score:.2f}\n{chunk.text[:200]}")
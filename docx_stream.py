@@ -0,0 +1,98 @@
+"""流式 DOCX 文本抽取
+
+直接用 iterparse 读 zip 包里的 word/document.xml，按文档顺序产出段落和表格行，
+处理完的节点立即清理，内存占用与文档长度无关。不依赖 python-docx。
+"""
+import zipfile
+import xml.etree.ElementTree as ET
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+BODY = W_NS + "body"
+P = W_NS + "p"
+T = W_NS + "t"
+TAB = W_NS + "tab"
+BR = W_NS + "br"
+CR = W_NS + "cr"
+TBL = W_NS + "tbl"
+TR = W_NS + "tr"
+TC = W_NS + "tc"
+V_MERGE = W_NS + "vMerge"
+VAL = W_NS + "val"
+
+
+def iter_docx_blocks(file):
+    """按文档顺序产出 ("paragraph", 文本) 和 ("row", [单元格文本, ...])
+
+    file 可以是路径或二进制文件对象。嵌套表格的内容并入外层单元格；
+    纵向合并 (vMerge) 的续接单元格输出为空串，不重复原文。
+    """
+    with zipfile.ZipFile(file) as zf, zf.open("word/document.xml") as xml:
+        body = None
+        para_stack = []  # 文本框里的段落会嵌套在段落内
+        table_depth = 0
+        row = None
+        cell = None
+        cell_continued = False
+
+        for event, elem in ET.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == P:
+                    para_stack.append([])
+                elif tag == TBL:
+                    table_depth += 1
+                elif table_depth == 1 and tag == TR:
+                    row = []
+                elif table_depth == 1 and tag == TC:
+                    cell = []
+                    cell_continued = False
+                elif tag == BODY:
+                    body = elem
+                continue
+
+            if tag == T:
+                if para_stack and elem.text:
+                    para_stack[-1].append(elem.text)
+            elif tag == TAB:
+                if para_stack:
+                    para_stack[-1].append("\t")
+            elif tag in (BR, CR):
+                if para_stack:
+                    para_stack[-1].append("\n")
+            elif tag == V_MERGE:
+                # 没有 val 或 val="continue" 表示被上一行合并
+                if table_depth == 1 and elem.get(VAL, "continue") == "continue":
+                    cell_continued = True
+            elif tag == P:
+                text = "".join(para_stack.pop())
+                if para_stack:
+                    para_stack[-1].append(text + "\n")
+                elif table_depth:
+                    if cell is not None:
+                        cell.append(text)
+                elif text.strip():
+                    yield "paragraph", text
+                elem.clear()
+            elif table_depth == 1 and tag == TC:
+                row.append("" if cell_continued else "\n".join(t for t in cell if t.strip()))
+                cell = None
+                elem.clear()
+            elif table_depth == 1 and tag == TR:
+                if any(c.strip() for c in row):
+                    yield "row", row
+                row = None
+                elem.clear()
+            elif tag == TBL:
+                table_depth -= 1
+                elem.clear()
+
+            # 顶层块处理完就从 body 上摘掉，保证内存有界
+            if body is not None and not para_stack and not table_depth and tag in (P, TBL):
+                body.clear()
+
+
+def docx_to_text(file):
+    lines = []
+    for kind, value in iter_docx_blocks(file):
+        lines.append(value if kind == "paragraph" else " | ".join(value))
+    return "\n".join(lines)
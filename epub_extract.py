@@ -0,0 +1,201 @@
+"""EPUB 按章节抽取：多进程解析 + 章节级磁盘缓存
+
+缓存按 (整本书的 sha256, 章节 item id) 存放，同一本书再次打开时直接读缓存；
+只有缺失的章节才会重新解析。缓存按整本书做 LRU 淘汰，总量不超过 CACHE_MAX_BYTES。EPUB 本身只是 zip + OPF 清单，直接用 zipfile 读，
+可以接受内存里的字节，不需要先落盘。
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from io import BytesIO
+from urllib.parse import unquote
+
+CACHE_DIR = os.path.join(os.environ.get("AIASSI_CACHE_DIR", os.path.expanduser("~/.cache/aiassi")), "epub")
+# 章节数少于这个值时串行解析，省掉进程间传输的开销
+PARALLEL_MIN_CHAPTERS = 32
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+DOCUMENT_MEDIA_TYPES = ("application/xhtml+xml", "text/html")
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@dataclass
+class Chapter:
+    item_id: str
+    title: str
+    text: str
+
+
+def html_to_text(content):
+    # lxml 在第一次解析章节时才加载 (进程池的子进程各自加载一次)
+    try:
+        import lxml.html
+    except ImportError:
+        lxml = None
+    if lxml is not None:
+        try:
+            return lxml.html.fromstring(content).text_content()
+        except (ValueError, lxml.etree.ParserError):
+            pass  # 空文档等情况退回 BeautifulSoup
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, "html.parser").get_text()
+
+
+def parse_chapter(job):
+    """进程池任务：(item_id, html 字节) -> Chapter"""
+    item_id, content = job
+    text = re.sub(r"\n\s*\n+", "\n\n", html_to_text(content)).strip()
+    title = next((line.strip() for line in text.splitlines() if line.strip()), item_id)[:40]
+    return Chapter(item_id, title, text)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Streamlit 服务端是多线程的，fork 出的子进程可能继承其他线程持有的锁 (包括导入锁)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def book_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def chapter_cache_path(digest, item_id):
+    safe_id = re.sub(r"[^\w.-]", "_", item_id)
+    return os.path.join(CACHE_DIR, digest, f"{safe_id}.json")
+
+
+def load_cached(digest, item_id):
+    try:
+        with open(chapter_cache_path(digest, item_id), encoding="utf-8") as f:
+            return Chapter(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_cached(digest, chapter):
+    path = chapter_cache_path(digest, chapter.item_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(chapter), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # 缓存写失败不影响抽取结果
+
+
+def load_manifest(digest):
+    path = os.path.join(CACHE_DIR, digest, "manifest.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            item_ids = json.load(f)
+        os.utime(path)  # manifest 的修改时间即整本书最近一次使用的时间
+        return item_ids
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(digest, item_ids):
+    try:
+        os.makedirs(os.path.join(CACHE_DIR, digest), exist_ok=True)
+        with open(os.path.join(CACHE_DIR, digest, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(item_ids, f)
+    except OSError:
+        pass
+
+
+def evict_cache(keep=None):
+    """总量超过 CACHE_MAX_BYTES 时按最近使用时间删除整本书的缓存，keep 为刚写入的那本"""
+    books = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                size, used = 0, 0.0
+                for name in os.listdir(entry.path):
+                    try:
+                        stat = os.stat(os.path.join(entry.path, name))
+                    except OSError:
+                        continue
+                    size += stat.st_size
+                    if name == "manifest.json":
+                        used = stat.st_mtime
+                books.append((used, size, entry.name))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in books)
+    for _, size, digest in sorted(books):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if digest == keep:
+            continue
+        shutil.rmtree(os.path.join(CACHE_DIR, digest), ignore_errors=True)
+        total -= size
+
+
+def read_documents(data):
+    """按 spine 阅读顺序返回正文 [(item_id, html 字节)]，spine 外的文档附在最后"""
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        container = ET.fromstring(zf.read("META-INF/container.xml"))
+        opf_path = container.find(f".//{CONTAINER_NS}rootfile").get("full-path")
+        opf = ET.fromstring(zf.read(opf_path))
+        opf_dir = posixpath.dirname(opf_path)
+
+        docs = {}
+        for item in opf.iter(f"{OPF_NS}item"):
+            if item.get("media-type") in DOCUMENT_MEDIA_TYPES:
+                docs[item.get("id")] = posixpath.normpath(posixpath.join(opf_dir, unquote(item.get("href"))))
+        spine = [ref.get("idref") for ref in opf.iter(f"{OPF_NS}itemref")]
+        ordered = [idref for idref in spine if idref in docs]
+        ordered += [item_id for item_id in docs if item_id not in ordered]
+        names = set(zf.namelist())
+        return [(item_id, zf.read(docs[item_id])) for item_id in ordered if docs[item_id] in names]
+
+
+def extract_chapters(source):
+    """source: 文件路径或整本书的字节；返回按阅读顺序排列的 [Chapter]"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            source = f.read()
+    digest = book_hash(source)
+
+    # 整本书都在缓存里时连 zip 都不用打开
+    item_ids = load_manifest(digest)
+    if item_ids is not None:
+        chapters = [load_cached(digest, item_id) for item_id in item_ids]
+        if all(chapters):
+            return chapters
+
+    documents = read_documents(source)
+    chapters = [load_cached(digest, item_id) for item_id, _ in documents]
+    jobs = [job for job, ch in zip(documents, chapters) if ch is None]
+
+    if len(jobs) >= PARALLEL_MIN_CHAPTERS:
+        parsed = list(get_pool().map(parse_chapter, jobs, chunksize=8))
+    else:
+        parsed = [parse_chapter(job) for job in jobs]
+
+    by_id = {ch.item_id: ch for ch in parsed}
+    for ch in parsed:
+        save_cached(digest, ch)
+    save_manifest(digest, [item_id for item_id, _ in documents])
+    if parsed:
+        evict_cache(keep=digest)
+    return [ch if ch is not None else by_id[item_id] for (item_id, _), ch in zip(documents, chapters)]
@@ -0,0 +1,194 @@
+"""文件接入流水线：文本抽取、MIME 判定、上传缓存、上传与就绪轮询
+
+不依赖 Streamlit，页面 (AIASSI.py) 和命令行批处理 (batch_cli.py) 共用。
+进度通过 report(msg) 回调输出，调用方决定显示在哪里。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import metrics
+from docx_stream import docx_to_text
+from epub_extract import extract_chapters
+from image_prep import IMAGE_EXTS, format_bytes, prepare_image
+
+
+def extract_text_from_docx(source):
+    """source: 文件路径或二进制文件对象"""
+    try:
+        # 流式解析 document.xml，段落与表格行保持原文顺序
+        return docx_to_text(source)
+    except Exception as e:
+        raise ValueError(f"Word 解析错误: {e}") from e
+
+
+def extract_text_from_epub(source):
+    """source: 文件路径或整本书的字节"""
+    try:
+        return "\n".join(ch.text for ch in extract_chapters(source))
+    except Exception as e:
+        raise ValueError(f"Epub 解析错误: {e}") from e
+
+
+def extract_text(file_ext, file_bytes):
+    """直接在内存里抽取文本，不落盘"""
+    if file_ext == '.docx': return extract_text_from_docx(BytesIO(file_bytes))
+    if file_ext == '.epub': return extract_text_from_epub(file_bytes)
+    return bytes(file_bytes).decode("utf-8", errors='ignore')
+
+
+# Gemini 原生支持直传的格式 -> MIME
+NATIVE_MIME_TYPES = {
+    '.pdf': 'application/pdf', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp',
+    '.mp3': 'audio/mp3', '.wav': 'audio/wav', '.aiff': 'audio/aiff', '.aac': 'audio/aac', '.ogg': 'audio/ogg', '.flac': 'audio/flac',
+}
+# 需要先本地抽取文本再上传的格式
+TEXT_EXTS = ['.docx', '.epub', '.txt', '.md', '.py', '.js', '.c', '.json']
+
+
+# 服务端文件保留 48 小时，缓存提前 2 小时失效，避免拿到即将过期的句柄
+UPLOAD_CACHE_TTL = 46 * 3600
+UPLOAD_CACHE_MARGIN = 2 * 3600
+
+
+def get_mime_type(file_ext):
+    if file_ext in NATIVE_MIME_TYPES: return NATIVE_MIME_TYPES[file_ext]
+    if file_ext in TEXT_EXTS: return "text/plain"
+    raise ValueError(f"暂不支持的文件格式: {file_ext}")
+
+
+def new_upload_cache():
+    """上传缓存：{(sha256, mime): (远端文件名, 失效时间戳)}，线程安全"""
+    return {"entries": {}, "lock": threading.Lock()}
+
+
+def lookup_upload_cache(backend, cache, cache_key):
+    with cache["lock"]:
+        entry = cache["entries"].get(cache_key)
+    if not entry: return None
+
+    file_name, expires_at = entry
+    myfile = None
+    if time.time() < expires_at:
+        # 服务端可能已提前删除文件，命中后再确认一次
+        try:
+            myfile = backend.get_file(file_name)
+        except Exception:
+            myfile = None
+    if myfile is None or myfile.state.name != "ACTIVE":
+        with cache["lock"]:
+            cache["entries"].pop(cache_key, None)
+        return None
+    return myfile
+
+
+def store_upload_cache(cache, cache_key, myfile):
+    expires_at = time.time() + UPLOAD_CACHE_TTL
+    expiration_time = getattr(myfile, "expiration_time", None)
+    if expiration_time:
+        expires_at = min(expires_at, expiration_time.timestamp() - UPLOAD_CACHE_MARGIN)
+    with cache["lock"]:
+        cache["entries"][cache_key] = (myfile.name, expires_at)
+
+
+def forget_upload(cache, file_name):
+    """远端文件被删除后，去掉指向它的缓存条目"""
+    with cache["lock"]:
+        for key in [k for k, (name, _) in cache["entries"].items() if name == file_name]:
+            del cache["entries"][key]
+
+
+# 并发上传参数：线程数、就绪轮询退避 (秒)、单批总超时
+INGEST_WORKERS = 4
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 5.0
+POLL_BACKOFF = 1.6
+INGEST_DEADLINE = 300
+
+
+def wait_until_active(backend, myfile, deadline, report):
+    """自适应退避轮询 PROCESSING 状态，超过 deadline 抛 TimeoutError"""
+    delay = POLL_INITIAL_DELAY
+    waited = 0.0
+    while myfile.state.name == "PROCESSING":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"云端处理超时 (已等待 {waited:.0f}s)")
+        time.sleep(min(delay, remaining))
+        waited += min(delay, remaining)
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+        myfile = backend.get_file(myfile.name)
+        report(f"🧠 AI 正在构建上下文索引... ({waited:.0f}s)")
+
+    if myfile.state.name == "FAILED":
+        raise ValueError("Gemini 无法处理此文件")
+    return myfile
+
+
+# 超过这个大小才落盘上传，其余直接把内存缓冲交给客户端
+UPLOAD_SPILL_BYTES = 64 * 1024 * 1024
+
+
+def upload_payload(backend, payload, mime_type, display_name):
+    if len(payload) <= UPLOAD_SPILL_BYTES:
+        return backend.upload_file(BytesIO(payload), mime_type=mime_type, display_name=display_name)
+
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        tmp.write(payload)
+    try:
+        return backend.upload_file(tmp.name, mime_type=mime_type, display_name=display_name)
+    finally:
+        os.remove(tmp.name)
+
+
+def ingest_one(backend, name, file_bytes, cache, deadline, report, image_preset=None):
+    """单个文件的完整流水线 (工作线程内执行，不直接调用 st.*，进度走 report)"""
+    file_ext = os.path.splitext(name)[1].lower()
+    mime_type = get_mime_type(file_ext)
+    if file_ext not in IMAGE_EXTS: image_preset = None
+
+    # 同一份内容 (原始字节 + MIME + 压缩档位) 已经在云端，直接复用句柄
+    cache_key = (hashlib.sha256(file_bytes).hexdigest(), f"{mime_type}|{image_preset}" if image_preset else mime_type)
+    cached_file = lookup_upload_cache(backend, cache, cache_key)
+    if cached_file:
+        report(f"♻️ 命中上传缓存，复用云端文件 `{cached_file.name}`")
+        return cached_file
+
+    if image_preset:
+        with metrics.timer("image_prep"):
+            image = prepare_image(file_bytes, image_preset, mime_type)
+        if image.saved_bytes > 0:
+            report(f"🗜️ 图片已压缩 {format_bytes(image.original_bytes)} → {format_bytes(len(image.data))}")
+        payload, mime_type = image.data, image.mime_type
+        report("🚀 正在直传云端...")
+    elif file_ext in NATIVE_MIME_TYPES:
+        report("🚀 检测到原生支持格式，正在直传云端...")
+        payload = file_bytes
+    else:
+        report(f"🔄 正在解析 {file_ext} 文档结构...")
+        with metrics.timer("extract"):
+            text_content = extract_text(file_ext, file_bytes)
+        if not text_content.strip(): raise ValueError(f"文档为空。")
+        payload = text_content.encode("utf-8")
+
+    report("☁️ 正在上传至 AI 知识库...")
+    with metrics.timer("upload"):
+        myfile = upload_payload(backend, payload, mime_type, name)
+
+    try:
+        report("🧠 AI 正在构建上下文索引...")
+        with metrics.timer("processing_wait"):
+            myfile = wait_until_active(backend, myfile, deadline, report)
+    except BaseException:
+        # 已上传但被取消 / 处理失败：文件不会进上传缓存，没人再引用，立即删掉而不是在云端留 48 小时
+        try:
+            backend.delete_file(myfile.name)
+        except Exception:
+            pass
+        raise
+
+    store_upload_cache(cache, cache_key, myfile)
+    return myfile
@@ -0,0 +1,332 @@
+"""模型后端接口
+
+页面里的所有模块只通过 Backend 调用模型 / 文件 / 上下文缓存，不直接碰 genai。
+- GeminiBackend：真实调用，每个 (api_key, 模型) 一组独立的客户端和模型对象
+- FakeBackend：离线、确定性的假后端，可配置延迟，用于压测和基准
+
+环境变量 AIASSI_BACKEND=fake 时页面改用 FakeBackend，不需要 API Key；
+AIASSI_FAKE_LATENCY 设置首字延迟 (秒)。
+create_backend 返回的后端都套了一层 ScheduledBackend，经过进程级的限流 / 重试 / 合并
+(见 request_scheduler.py)。
+"""
+import datetime
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+from request_scheduler import INTERACTIVE, request_key, scheduler_for
+
+BACKEND_NAME = os.environ.get("AIASSI_BACKEND", "gemini")
+DEFAULT_MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
+
+
+class Backend:
+    """模块代码依赖的最小接口；model() 返回的对象需提供
+    generate_content(contents, stream=False) 和 count_tokens(contents)，形状与 genai 一致。"""
+
+    def model(self):
+        raise NotImplementedError
+
+    def model_from_cache(self, cache):
+        raise NotImplementedError
+
+    def upload_file(self, source, mime_type, display_name=None):
+        raise NotImplementedError
+
+    def get_file(self, name):
+        raise NotImplementedError
+
+    def delete_file(self, name):
+        raise NotImplementedError
+
+    def create_cached_content(self, contents, ttl, display_name=None):
+        raise NotImplementedError
+
+
+class GeminiCache:
+    """服务端上下文缓存。genai 的 CachedContent.update / delete 走进程级默认客户端，
+    这里改用所属 Key 的客户端；name / model / expire_time 与 CachedContent 一致"""
+
+    def __init__(self, proto, client):
+        self.proto = proto
+        self.client = client
+
+    @property
+    def name(self):
+        return self.proto.name
+
+    @property
+    def model(self):
+        return self.proto.model
+
+    @property
+    def expire_time(self):
+        return self.proto.expire_time
+
+    def update(self, ttl):
+        from google.generativeai import protos
+        from google.generativeai.types import caching_types
+        from google.protobuf import field_mask_pb2
+        request = protos.UpdateCachedContentRequest(
+            cached_content=protos.CachedContent(name=self.name, ttl=caching_types.to_optional_ttl(ttl)),
+            update_mask=field_mask_pb2.FieldMask(paths=["ttl"]),
+        )
+        self.proto = self.client.update_cached_content(request)
+
+    def delete(self):
+        from google.generativeai import protos
+        self.client.delete_cached_content(protos.DeleteCachedContentRequest(name=self.name))
+
+
+class GeminiBackend(Backend):
+    """每个 Key 一组独立的 API 客户端，不调用 genai.configure 这种进程级配置：
+    多个会话用不同 Key 并发调用时，文件归属和配额都记在各自的 Key 上"""
+
+    def __init__(self, api_key, model_name):
+        import google.ai.generativelanguage as glm
+        import google.generativeai as genai
+        from google.generativeai.client import FileServiceClient
+        self.genai = genai
+        self.model_name = model_name
+        options = {"api_key": api_key}
+        self.generative_client = glm.GenerativeServiceClient(client_options=options)
+        # genai 的 FileServiceClient 子类才有 create_file (可上传内存缓冲)
+        self.file_client = FileServiceClient(client_options=options)
+        self.cache_client = glm.CacheServiceClient(client_options=options)
+        self._model = self._bind(genai.GenerativeModel(model_name))
+
+    def _bind(self, model):
+        # GenerativeModel 只在 _client 为空时才取进程级默认客户端
+        model._client = self.generative_client
+        return model
+
+    def model(self):
+        return self._model
+
+    def model_from_cache(self, cache):
+        return self._bind(self.genai.GenerativeModel.from_cached_content(cached_content=cache))
+
+    def upload_file(self, source, mime_type, display_name=None):
+        from google.generativeai.types.file_types import File
+        return File(self.file_client.create_file(path=source, mime_type=mime_type, display_name=display_name))
+
+    def get_file(self, name):
+        from google.generativeai.types.file_types import File
+        return File(self.file_client.get_file(name=name))
+
+    def delete_file(self, name):
+        self.file_client.delete_file(name=name)
+
+    def create_cached_content(self, contents, ttl, display_name=None):
+        from google.generativeai import protos
+        from google.generativeai.types import caching_types, content_types
+        contents = content_types.to_contents(contents)
+        if not contents[-1].role:
+            contents[-1].role = "user"
+        request = protos.CreateCachedContentRequest(cached_content=protos.CachedContent(
+            model=f"models/{self.model_name}", display_name=display_name, contents=contents,
+            ttl=caching_types.to_optional_ttl(ttl),
+        ))
+        return GeminiCache(self.cache_client.create_cached_content(request), self.cache_client)
+
+
+# ---------------- 离线假后端 ----------------
+
+def _describe(contents):
+    """把 contents 变成稳定的字符串，用来生成确定性的回复"""
+    if isinstance(contents, (list, tuple)):
+        return "|".join(_describe(c) for c in contents)
+    return getattr(contents, "name", None) or str(contents)
+
+
+@dataclass
+class FakeFile:
+    name: str
+    mime_type: str
+    size: int
+    polls_left: int = 0
+    expiration_time: object = None
+
+    @property
+    def state(self):
+        return SimpleNamespace(name="PROCESSING" if self.polls_left > 0 else "ACTIVE")
+
+
+@dataclass
+class FakeCachedContent:
+    name: str
+    contents: list
+    ttl: object
+    expire_time: object = None
+    deleted: bool = False
+
+    def __post_init__(self):
+        self.update(self.ttl)
+
+    def update(self, ttl):
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+
+    def delete(self):
+        self.deleted = True
+
+
+@dataclass
+class FakeResponse:
+    text: str
+    usage_metadata: object
+    chunks: list = field(default_factory=list)
+    chunk_delay: float = 0.0
+
+    def __iter__(self):
+        for piece in self.chunks:
+            time.sleep(self.chunk_delay)
+            yield SimpleNamespace(text=piece)
+
+
+class FakeModel:
+    def __init__(self, backend, cached=None):
+        self.backend = backend
+        self.cached = cached
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=len(_describe(contents)) // 2 + 1)
+
+    def generate_content(self, contents, stream=False):
+        backend = self.backend
+        with backend.lock:
+            backend.calls += 1
+        time.sleep(backend.latency)
+        # 回复只取决于输入内容，同样的输入总是得到同样的输出
+        digest = hashlib.sha256(_describe(contents).encode("utf-8")).hexdigest()[:12]
+        text = f"[fake:{digest}] {backend.reply_template}"
+        cached_tokens = self.count_tokens(self.cached.contents).total_tokens if self.cached else 0
+        usage = SimpleNamespace(
+            prompt_token_count=self.count_tokens(contents).total_tokens + cached_tokens,
+            candidates_token_count=len(text) // 2 + 1,
+            cached_content_token_count=cached_tokens,
+        )
+        if not stream:
+            return FakeResponse(text, usage)
+        step = max(1, len(text) // backend.stream_chunks)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+        return FakeResponse(text, usage, pieces, backend.chunk_latency)
+
+
+class FakeBackend(Backend):
+    def __init__(self, latency=0.0, chunk_latency=0.0, upload_latency=0.0, processing_polls=0,
+                 stream_chunks=8, reply_template="这是一条离线生成的回复。"):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.upload_latency = upload_latency
+        self.processing_polls = processing_polls
+        self.stream_chunks = stream_chunks
+        self.reply_template = reply_template
+        self.calls = 0
+        self.files = {}
+        self.lock = threading.Lock()
+        self._model = FakeModel(self)
+
+    def model(self):
+        return self._model
+
+    def model_from_cache(self, cache):
+        return FakeModel(self, cached=cache)
+
+    def upload_file(self, source, mime_type, display_name=None):
+        time.sleep(self.upload_latency)
+        if hasattr(source, "read"):
+            data = source.read()
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        name = "files/" + hashlib.sha256(data).hexdigest()[:16]
+        with self.lock:
+            self.files[name] = FakeFile(name, mime_type, len(data), self.processing_polls)
+            return self.files[name]
+
+    def get_file(self, name):
+        with self.lock:
+            f = self.files.get(name)
+            if f is None:
+                raise KeyError(f"{name} not found")
+            if f.polls_left > 0:
+                f.polls_left -= 1
+            return f
+
+    def delete_file(self, name):
+        with self.lock:
+            if self.files.pop(name, None) is None:
+                raise KeyError(f"{name} not found")
+
+    def create_cached_content(self, contents, ttl, display_name=None):
+        return FakeCachedContent(f"cachedContents/{display_name}", list(contents), ttl)
+
+
+# ---------------- 调度包装 ----------------
+
+class ScheduledModel:
+    """相同的在途请求合并：非流式共享结果，流式共享同一条上游流 (限流和重试只作用于建立连接)"""
+
+    def __init__(self, inner, scheduler, priority):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def generate_content(self, contents, stream=False):
+        if stream:
+            return self.scheduler.stream(lambda: self.inner.generate_content(contents, stream=True), self.priority,
+                                         key=request_key(self.inner, contents, "stream"))
+        return self.scheduler.run(lambda: self.inner.generate_content(contents), self.priority,
+                                  key=request_key(self.inner, contents))
+
+    def count_tokens(self, contents):
+        # 计数接口有独立配额，不占生成请求的令牌
+        return self.scheduler.run(lambda: self.inner.count_tokens(contents), self.priority,
+                                  key=request_key(self.inner, contents, "count"), limited=False)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+class ScheduledBackend(Backend):
+    def __init__(self, inner, scheduler, priority=INTERACTIVE):
+        self.inner = inner
+        self.scheduler = scheduler
+        self.priority = priority
+        self._model = ScheduledModel(inner.model(), scheduler, priority)
+
+    def model(self):
+        return self._model
+
+    def model_from_cache(self, cache):
+        return ScheduledModel(self.inner.model_from_cache(cache), self.scheduler, self.priority)
+
+    def upload_file(self, source, mime_type, display_name=None):
+        def upload():
+            if hasattr(source, "seek"): source.seek(0)  # 重试时从头再读
+            return self.inner.upload_file(source, mime_type, display_name)
+        return self.scheduler.run(upload, self.priority)
+
+    def get_file(self, name):
+        return self.scheduler.run(lambda: self.inner.get_file(name), self.priority, limited=False)
+
+    def delete_file(self, name):
+        return self.scheduler.run(lambda: self.inner.delete_file(name), self.priority, limited=False)
+
+    def create_cached_content(self, contents, ttl, display_name=None):
+        return self.scheduler.run(lambda: self.inner.create_cached_content(contents, ttl, display_name), self.priority)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def create_backend(api_key, model_name, priority=INTERACTIVE, rpm=None):
+    """priority: 页面用 interactive，批处理用 batch；rpm 为空时沿用该 Key 当前的限速"""
+    if BACKEND_NAME == "fake":
+        inner = FakeBackend(latency=float(os.environ.get("AIASSI_FAKE_LATENCY", "0")))
+    else:
+        inner = GeminiBackend(api_key, model_name)
+    return ScheduledBackend(inner, scheduler_for(api_key, rpm), priority)
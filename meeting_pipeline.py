@@ -0,0 +1,199 @@
+"""长会议录音的分段 map-reduce
+
+录音按时间切成有重叠的片段 (WAV 按采样帧，MP3 按帧头对齐，纯标准库)，
+每段并发生成分段笔记，最后合并成完整纪要。已完成的片段结果保存在 MeetingJob 里，
+失败的片段可以单独重试，不用重跑整段录音。
+"""
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from io import BytesIO
+
+SEGMENT_SECONDS = 15 * 60
+OVERLAP_SECONDS = 30
+MEETING_CONCURRENCY = 4
+
+MAP_PROMPT = """这是一段会议录音的第 {index}/{total} 段 ({start} - {end})，与相邻片段有约 {overlap} 秒重叠。
+请只整理本段内容，输出：
+1. 要点摘要
+2. 本段做出的决策
+3. 待办事项 (负责人 / 截止时间，如有提到)
+4. 关键发言与讨论回顾
+"""
+
+REDUCE_PROMPT = """{instruction}
+
+以下是按时间顺序排列的分段笔记，相邻片段有重叠，请去重、合并同一话题，
+整理成一份完整纪要，按「摘要、决策清单、待办事项、详细回顾」组织。
+
+{notes}
+"""
+
+# MPEG 音频帧头查表
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+@dataclass
+class Segment:
+    index: int
+    start: float
+    end: float
+    data: bytes
+    mime_type: str
+
+    @property
+    def name(self):
+        ext = ".wav" if self.mime_type == "audio/wav" else ".mp3"
+        return f"segment_{self.index:03d}{ext}"
+
+    def getvalue(self):
+        # 与 Streamlit UploadedFile 同形，可以直接交给上传流水线
+        return self.data
+
+
+@dataclass
+class MeetingJob:
+    segments: list
+    notes: dict = field(default_factory=dict)  # 片段序号 -> 分段笔记
+    errors: dict = field(default_factory=dict)  # 片段序号 -> 错误信息
+
+    @property
+    def pending(self):
+        return [s for s in self.segments if s.index not in self.notes]
+
+
+def fmt_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def windows(duration, segment_seconds, overlap_seconds):
+    step = segment_seconds - overlap_seconds
+    start = 0.0
+    while True:
+        end = min(start + segment_seconds, duration)
+        yield start, end
+        if end >= duration:
+            return
+        start += step
+
+
+def split_wav(data, segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    with wave.open(BytesIO(data)) as src:
+        params = src.getparams()
+        rate = src.getframerate()
+        frames = src.readframes(src.getnframes())
+    frame_bytes = params.sampwidth * params.nchannels
+    duration = len(frames) / frame_bytes / rate
+
+    segments = []
+    for i, (start, end) in enumerate(windows(duration, segment_seconds, overlap_seconds)):
+        out = BytesIO()
+        with wave.open(out, "wb") as dst:
+            dst.setparams(params)
+            dst.writeframes(frames[int(start * rate) * frame_bytes:int(end * rate) * frame_bytes])
+        segments.append(Segment(i, start, end, out.getvalue(), "audio/wav"))
+    return segments
+
+
+def mp3_frames(data):
+    """产出 (字节偏移, 帧时长秒)，跳过 ID3v2 标签和无法识别的字节"""
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    n = len(data)
+    while pos + 4 <= n:
+        b1, b2 = data[pos + 1], data[pos + 2]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1
+            continue
+        version = {3: 1, 2: 2, 0: 25}.get((b1 >> 3) & 3)
+        layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 3)
+        bitrate_idx, rate_idx, padding = b2 >> 4, (b2 >> 2) & 3, (b2 >> 1) & 1
+        if version is None or layer is None or bitrate_idx in (0, 15) or rate_idx == 3:
+            pos += 1
+            continue
+        bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_idx] * 1000
+        rate = MP3_SAMPLE_RATES[version][rate_idx]
+        if layer == 1:
+            length, samples = (12 * bitrate // rate + padding) * 4, 384
+        elif layer == 3 and version != 1:
+            length, samples = 72 * bitrate // rate + padding, 576
+        else:
+            length, samples = 144 * bitrate // rate + padding, 1152
+        yield pos, samples / rate
+        pos += length
+
+
+def split_mp3(data, segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    offsets, times = [], []
+    t = 0.0
+    for offset, seconds in mp3_frames(data):
+        offsets.append(offset)
+        times.append(t)
+        t += seconds
+    if not offsets:
+        return []
+    offsets.append(len(data))
+
+    segments = []
+    first = 0
+    for i, (start, end) in enumerate(windows(t, segment_seconds, overlap_seconds)):
+        while first < len(times) and times[first] < start:
+            first += 1
+        last = first
+        while last < len(times) and times[last] < end:
+            last += 1
+        segments.append(Segment(i, start, end, data[offsets[first]:offsets[last]], "audio/mp3"))
+    return segments
+
+
+def split_recording(data, file_ext, segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """能切分的格式返回片段列表；不支持的容器格式或录音不够长时返回 None"""
+    if file_ext == ".wav":
+        segments = split_wav(data, segment_seconds, overlap_seconds)
+    elif file_ext == ".mp3":
+        segments = split_mp3(data, segment_seconds, overlap_seconds)
+    else:
+        return None
+    return segments if len(segments) > 1 else None
+
+
+def run_map(job, map_fn, max_workers=MEETING_CONCURRENCY, on_done=None):
+    """并发处理尚未完成的片段：map_fn(segment) -> 分段笔记。
+    成功的结果写进 job.notes，失败的写进 job.errors；返回本轮失败的片段数。"""
+    pending = job.pending
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(map_fn, seg): seg for seg in pending}
+        for fut in as_completed(futures):
+            seg = futures[fut]
+            try:
+                job.notes[seg.index] = fut.result()
+                job.errors.pop(seg.index, None)
+            except Exception as e:
+                job.errors[seg.index] = str(e)
+            if on_done:
+                on_done(seg, seg.index in job.notes)
+    return len(job.errors)
+
+
+def map_prompt(segment, total):
+    return MAP_PROMPT.format(index=segment.index + 1, total=total, start=fmt_time(segment.start),
+                             end=fmt_time(segment.end), overlap=OVERLAP_SECONDS)
+
+
+def reduce_prompt(job, instruction):
+    notes = "\n\n".join(
+        f"### 片段 {s.index + 1} ({fmt_time(s.start)} - {fmt_time(s.end)})\n{job.notes[s.index]}" for s in job.segments
+    )
+    return REDUCE_PROMPT.format(instruction=instruction, notes=notes)
@@ -0,0 +1,164 @@
+"""轻量埋点：分阶段耗时 + 各模块 token 用量
+
+进程级注册表，线程安全，工作线程里也能直接记录。
+- timer(stage) / observe(stage, seconds)：抽取、上传、PROCESSING 等待、生成、首字、TTS 等阶段耗时
+- set_gauge(name, value)：会话数、会话内存等瞬时值
+- instrument(model, mode)：包一层模型，自动记录生成耗时、首字延迟和 usage_metadata
+- prometheus_text()：Prometheus 文本格式；环境变量 AIASSI_METRICS_LOG 指向文件时，
+  每个事件另外追加一行 JSON，供看板采集
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_LOG = os.environ.get("AIASSI_METRICS_LOG")
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_FIELDS = ("prompt_token_count", "candidates_token_count", "cached_content_token_count")
+
+_lock = threading.Lock()
+_stages = {}  # (stage, mode) -> {"count", "sum", "max", "buckets"}
+_tokens = {}  # (mode, field) -> 累计 token 数
+_gauges = {}  # name -> 最近一次的值
+
+
+def _log(event):
+    if not METRICS_LOG:
+        return
+    event["ts"] = round(time.time(), 3)
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    with _lock:
+        with open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def observe(stage, seconds, mode=""):
+    with _lock:
+        s = _stages.setdefault((stage, mode), {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)})
+        s["count"] += 1
+        s["sum"] += seconds
+        s["max"] = max(s["max"], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                s["buckets"][i] += 1
+    _log({"stage": stage, "mode": mode, "seconds": round(seconds, 4)})
+
+
+@contextmanager
+def timer(stage, mode=""):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, mode)
+
+
+def record_usage(mode, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    counts = {f: getattr(usage, f, 0) or 0 for f in TOKEN_FIELDS}
+    with _lock:
+        for field, n in counts.items():
+            _tokens[(mode, field)] = _tokens.get((mode, field), 0) + n
+    _log({"usage": counts, "mode": mode})
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def gauges():
+    with _lock:
+        return dict(_gauges)
+
+
+class _TimedStream:
+    """流式响应：第一个块到达时记首字延迟，迭代结束时记总耗时和用量"""
+
+    def __init__(self, response, started, mode):
+        self.response = response
+        self.started = started
+        self.mode = mode
+
+    def __iter__(self):
+        first = True
+        for chunk in self.response:
+            if first:
+                observe("first_token", time.perf_counter() - self.started, self.mode)
+                first = False
+            yield chunk
+        observe("generate", time.perf_counter() - self.started, self.mode)
+        record_usage(self.mode, self.response)
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class InstrumentedModel:
+    def __init__(self, inner, mode):
+        self.inner = inner
+        self.mode = mode
+
+    def generate_content(self, contents, stream=False):
+        started = time.perf_counter()
+        if stream:
+            return _TimedStream(self.inner.generate_content(contents, stream=True), started, self.mode)
+        response = self.inner.generate_content(contents)
+        observe("generate", time.perf_counter() - started, self.mode)
+        record_usage(self.mode, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def instrument(model, mode):
+    return InstrumentedModel(model, mode) if model is not None else None
+
+
+def snapshot():
+    """返回 (阶段耗时行, token 用量行)，供开发者面板显示"""
+    with _lock:
+        stages = [
+            {"stage": stage, "mode": mode, "count": s["count"], "avg_s": round(s["sum"] / s["count"], 3), "max_s": round(s["max"], 3)}
+            for (stage, mode), s in sorted(_stages.items())
+        ]
+        modes = sorted({mode for mode, _ in _tokens})
+        tokens = [{"mode": mode, **{f: _tokens.get((mode, f), 0) for f in TOKEN_FIELDS}} for mode in modes]
+    return stages, tokens
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    lines = [
+        "# HELP aiassi_stage_seconds Per-stage latency.",
+        "# TYPE aiassi_stage_seconds histogram",
+    ]
+    with _lock:
+        for (stage, mode), s in sorted(_stages.items()):
+            labels = f'stage="{_label(stage)}",mode="{_label(mode)}"'
+            for bound, n in zip(BUCKETS, s["buckets"]):
+                lines.append(f'aiassi_stage_seconds_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'aiassi_stage_seconds_bucket{{{labels},le="+Inf"}} {s["count"]}')
+            lines.append(f"aiassi_stage_seconds_sum{{{labels}}} {s['sum']:.6f}")
+            lines.append(f"aiassi_stage_seconds_count{{{labels}}} {s['count']}")
+        lines += ["# HELP aiassi_tokens_total Tokens reported by usage_metadata.", "# TYPE aiassi_tokens_total counter"]
+        for (mode, field), n in sorted(_tokens.items()):
+            kind = field.replace("_token_count", "")
+            lines.append(f'aiassi_tokens_total{{mode="{_label(mode)}",kind="{kind}"}} {n}')
+        for name, value in sorted(_gauges.items()):
+            lines += [f"# TYPE aiassi_{name} gauge", f"aiassi_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _tokens.clear()
+        _gauges.clear()
@@ -0,0 +1,170 @@
+"""各功能模块的提示词模板、请求组装与无界面执行入口
+
+页面 (AIASSI.py) 和命令行批处理 (batch_cli.py) 都通过这里的 *_request / 流水线函数
+组装请求，页面只负责上传进度、流式渲染和缓存这些界面部分。
+模板文本也是响应缓存键的一部分，改动会让旧缓存失效。
+"""
+import os
+import time
+
+import metrics
+from image_prep import prepare_image
+from ingest import INGEST_DEADLINE, TEXT_EXTS, extract_text, get_mime_type, ingest_one, new_upload_cache
+
+PHOTO_QA_DEFAULT_PROMPT = "请详细解读这份内容。"
+CONTRACT_PROMPT = """
+                    你是一位资深法律顾问。请严格审查这份合同文件。
+                    输出一份《法律风险评估报告》，包含：高风险条款预警、权益保障缺失、修改建议(表格)、总体评分。
+                    """
+SCRIPT_PROMPT = "写一个Python脚本：{requirement}。要求：健壮、有注释。"
+MEETING_PROMPT = "请作为专业的首席会议秘书，根据录音生成一份完美的会议纪要。包含摘要、决策清单、待办事项和详细回顾。"
+CAPTION_PROMPT = "写3条{style}风格的朋友圈文案，带Emoji。"
+CAPTION_STYLES = ["文艺清新", "幽默搞笑", "扎心语录", "小红书爆款"]
+MEDICAL_PROMPTS = {"体检解读": "解读体检报告", "药品识别": "解读药品说明书"}
+
+# 口语陪练：目标语言 -> 语音代码、练习场景、开场白
+COACH_LANGUAGES = {"韩语 (Korean)": "ko-KR", "英语 (English)": "en-US", "日语 (Japanese)": "ja-JP", "法语 (French)": "fr-FR", "泰语 (Thai)": "th-TH"}
+COACH_SCENARIOS = ["日常闲聊", "餐厅点餐", "旅行问路", "初次见面", "商务会议"]
+OPENER_PROMPT = "你现在是一位地道的{target_lang}母语者。请用{target_lang}向我打招呼，并发起一个关于'{scenario}'的话题。请只输出{target_lang}，不要带翻译。"
+# 开场白池里同一组合的几条变体用不同语气生成，避免每次都一样
+OPENER_TONES = ["轻松随意", "热情友好", "好奇发问", "略带幽默"]
+
+
+def opener_prompt(target_lang, scenario, tone=None):
+    prompt = OPENER_PROMPT.format(target_lang=target_lang, scenario=scenario)
+    return f"{prompt}语气{tone}。" if tone else prompt
+
+# 各模式接受的文件格式
+MODE_EXTS = {
+    "photo_qa": ['.jpg', '.jpeg', '.png', '.pdf'],
+    "contract": ['.pdf', '.docx', '.epub', '.txt', '.md', '.jpg', '.jpeg', '.png'],
+    "meeting": ['.mp3', '.wav', '.ogg', '.flac', '.aac'],
+    "medical": ['.jpg', '.jpeg', '.png', '.pdf'],
+    "caption": ['.jpg', '.jpeg', '.png'],
+    "script": ['.txt', '.md'],
+}
+
+
+def inline_blob(name, data, image_preset):
+    """小图不走上传，压缩后作为 inline blob 直接放进请求；返回 (blob, PreparedImage)"""
+    file_ext = os.path.splitext(name)[1].lower()
+    image = prepare_image(data, image_preset, get_mime_type(file_ext))
+    return {"mime_type": image.mime_type, "data": image.data}, image
+
+
+# ---------------- 各模块的请求组装 ----------------
+
+def photo_qa_request(files, question=""):
+    return [question or PHOTO_QA_DEFAULT_PROMPT, *files]
+
+
+def medical_request(file, med_type):
+    return [MEDICAL_PROMPTS[med_type], file]
+
+
+def caption_request(blob, style):
+    return [CAPTION_PROMPT.format(style=style), blob]
+
+
+def script_request(requirement):
+    return SCRIPT_PROMPT.format(requirement=requirement)
+
+
+def contract_request(files):
+    return [CONTRACT_PROMPT, *files]
+
+
+def clause_reviewable(names):
+    """全部为能本地抽出文本的格式时，合同走逐条款并行审查"""
+    return bool(names) and all(os.path.splitext(n)[1].lower() in TEXT_EXTS for n in names)
+
+
+def contract_clauses(named_files):
+    """named_files: [(文件名, 字节)]，按顺序拼接全文后切分条款"""
+    from contract_review import segment_clauses
+    return segment_clauses("\n".join(extract_text(os.path.splitext(n)[1].lower(), data) for n, data in named_files))
+
+
+def contract_report(model, clauses, cached=None, on_batch=None):
+    """逐条款审查；cached 为 {条款哈希: 结果}。返回 (报告, 本次新审查的 {条款哈希: 结果})"""
+    from contract_review import build_report, review_clauses
+    if not clauses:
+        raise ValueError("没有识别出可审查的条款")
+    findings, missing, fresh = review_clauses(model, clauses, cached or {}, on_batch=on_batch)
+    return build_report(clauses, findings, missing), fresh
+
+
+def meeting_job(name, data):
+    """能切分的录音返回 MeetingJob，否则返回 None (整段上传)"""
+    from meeting_pipeline import MeetingJob, split_recording
+    segments = split_recording(data, os.path.splitext(name)[1].lower())
+    return MeetingJob(segments) if segments else None
+
+
+def run_meeting_map(job, backend, model, upload_cache, on_done=None, on_upload=None, prefetched=None):
+    """并发整理未完成的片段，返回失败数；on_upload(文件) 在每个片段上传后调用 (工作线程内)。
+    prefetched 为 {片段序号: 预上传 Future}，对应片段直接等这个任务的结果。"""
+    from meeting_pipeline import run_map
+    map_fn = meeting_map_fn(backend, model, upload_cache, len(job.segments), on_upload, prefetched)
+    return run_map(job, map_fn, on_done=on_done)
+
+
+def meeting_request(job=None, file=None):
+    """分段任务完成后的合并 prompt；不能切分的录音直接带上整段文件"""
+    from meeting_pipeline import reduce_prompt
+    return reduce_prompt(job, MEETING_PROMPT) if job is not None else [MEETING_PROMPT, file]
+
+
+def meeting_map_fn(backend, model, upload_cache, total, on_upload=None, prefetched=None):
+    """分段 map 任务：上传片段 (有预上传任务时等它的结果，失败或已取消再自己传) 并生成该段笔记"""
+    from meeting_pipeline import map_prompt
+    prefetched = prefetched or {}
+    def map_segment(seg):
+        seg_file = None
+        if seg.index in prefetched:
+            try:
+                seg_file = prefetched[seg.index].result()
+            except Exception:
+                pass
+        if seg_file is None:
+            seg_file = ingest_one(backend, seg.name, seg.data, upload_cache, time.monotonic() + INGEST_DEADLINE, lambda msg: None)
+        if on_upload: on_upload(seg_file)
+        return model.generate_content([map_prompt(seg, total), seg_file]).text
+    return map_segment
+
+
+def run_file_mode(backend, mode, name, data, options=None, upload_cache=None, report=lambda msg: None):
+    """对单个文件执行一个模块，返回生成的文本 (非流式)。options 对应页面上的选项：
+    question (photo_qa)、med_type (medical)、style (caption)。"""
+    options = options or {}
+    model = metrics.instrument(backend.model(), mode)
+    upload_cache = upload_cache if upload_cache is not None else new_upload_cache()
+    file_ext = os.path.splitext(name)[1].lower()
+
+    def upload(image_preset=None):
+        return ingest_one(backend, name, data, upload_cache, time.monotonic() + INGEST_DEADLINE, report, image_preset)
+
+    if mode == "photo_qa":
+        contents = photo_qa_request([upload("photo_qa")], options.get("question", ""))
+    elif mode == "medical":
+        contents = medical_request(upload("medical"), options.get("med_type", "体检解读"))
+    elif mode == "caption":
+        blob, _ = inline_blob(name, data, "caption")
+        contents = caption_request(blob, options.get("style", CAPTION_STYLES[0]))
+    elif mode == "script":
+        contents = script_request(extract_text(file_ext, data))
+    elif mode == "contract":
+        if clause_reviewable([name]):
+            return contract_report(model, contract_clauses([(name, data)]))[0]
+        contents = contract_request([upload()])
+    elif mode == "meeting":
+        job = meeting_job(name, data)
+        if job is None:
+            contents = meeting_request(file=upload())
+        else:
+            if run_meeting_map(job, backend, model, upload_cache):
+                raise ValueError(f"{len(job.errors)} 个片段失败: {job.errors}")
+            contents = meeting_request(job)
+    else:
+        raise ValueError(f"未知模块: {mode}")
+    return model.generate_content(contents).text
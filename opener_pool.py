@@ -0,0 +1,149 @@
+"""口语陪练的开场白池
+
+每个 (目标语言, 场景) 预先生成几条不同的开场白，连同逐句合成好的语音一起落盘；
+重置对话时直接取一条，后台线程再按限速补上。池子跨进程重启保留。
+模型只需要提供 generate_content(prompt).text；语音用 TTSEngine 的合成器生成。
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from tts import split_sentences
+
+POOL_DIR = os.path.join(os.environ.get("AIASSI_CACHE_DIR", os.path.expanduser("~/.cache/aiassi")), "openers")
+VARIANTS = 3
+# 两次补货之间的最小间隔 (秒)；补货请求还会经过调度器的批处理优先级
+REFILL_INTERVAL = 4.0
+FAILURE_BACKOFF = 60.0
+
+
+class OpenerPool:
+    def __init__(self, pairs, make_prompt, tts_engine, pool_dir=POOL_DIR, variants=VARIANTS, refill_interval=REFILL_INTERVAL):
+        """pairs: {(目标语言, 场景): 语音代码}；make_prompt(目标语言, 场景) -> 生成开场白的 prompt"""
+        self.pairs = pairs
+        self.make_prompt = make_prompt
+        self.tts_engine = tts_engine
+        self.pool_dir = pool_dir
+        self.variants = variants
+        self.refill_interval = refill_interval
+        self.model = None
+        self.lock = threading.Lock()
+        self.model_ready = threading.Event()
+        self.todo = queue.Queue()
+        self.queued = set()
+        os.makedirs(os.path.join(pool_dir, "audio"), exist_ok=True)
+        self.pool = self._load()
+        for pair in pairs:
+            self._request(pair)
+        threading.Thread(target=self._refill_loop, name="opener-pool", daemon=True).start()
+
+    # ---------------- 持久化 ----------------
+
+    @property
+    def index_path(self):
+        return os.path.join(self.pool_dir, "pool.json")
+
+    def _audio_path(self, chunk, lang_code):
+        digest = hashlib.sha256(f"{lang_code}\n{chunk}".encode("utf-8")).hexdigest()
+        return os.path.join(self.pool_dir, "audio", f"{digest}.mp3")
+
+    def _load(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        pool = {}
+        for entry in raw:
+            pair = (entry["target_lang"], entry["scenario"])
+            if pair in self.pairs:
+                pool[pair] = list(entry["texts"])
+        return pool
+
+    def _save(self):
+        """调用方需持有锁；先写临时文件再替换，进程中途退出不会留下半个文件"""
+        raw = [{"target_lang": lang, "scenario": scenario, "texts": texts} for (lang, scenario), texts in self.pool.items()]
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    # ---------------- 取用 ----------------
+
+    def attach(self, model):
+        """设置用于补货的模型 (应绑定服务端自己的 Key：池子跨会话共享，补货费用不该落在某个访客头上)；
+        没有模型时只发放已落盘的开场白"""
+        self.model = model
+        if model is not None:
+            self.model_ready.set()
+
+    def take(self, target_lang, scenario):
+        """取出一条开场白并把它的语音放进 TTS 缓存；池子空了返回 None"""
+        pair = (target_lang, scenario)
+        with self.lock:
+            texts = self.pool.get(pair)
+            text = texts.pop(random.randrange(len(texts))) if texts else None
+            if text is not None:
+                self._save()
+        self._request(pair)
+        if text is None:
+            return None
+        lang_code = self.pairs[pair]
+        for chunk in split_sentences(text):
+            path = self._audio_path(chunk, lang_code)
+            try:
+                with open(path, "rb") as f:
+                    self.tts_engine.put(chunk, lang_code, f.read())
+                os.remove(path)
+            except OSError:
+                pass  # 没有预合成的语音，TTSEngine 会照常在后台合成
+        return text
+
+    def size(self):
+        with self.lock:
+            return sum(len(texts) for texts in self.pool.values())
+
+    # ---------------- 后台补货 ----------------
+
+    def _request(self, pair):
+        with self.lock:
+            if pair in self.queued or len(self.pool.get(pair, [])) >= self.variants:
+                return
+            self.queued.add(pair)
+        self.todo.put(pair)
+
+    def _refill_one(self, pair):
+        target_lang, scenario = pair
+        lang_code = self.pairs[pair]
+        text = self.model.generate_content(self.make_prompt(target_lang, scenario)).text.strip()
+        if not text:
+            return
+        for chunk in split_sentences(text):
+            try:
+                audio = self.tts_engine.synthesizer(chunk, lang_code)
+            except Exception:
+                audio = None
+            if audio:
+                with open(self._audio_path(chunk, lang_code), "wb") as f:
+                    f.write(audio)
+        with self.lock:
+            self.pool.setdefault(pair, []).append(text)
+            self._save()
+
+    def _refill_loop(self):
+        while True:
+            pair = self.todo.get()
+            self.model_ready.wait()
+            try:
+                self._refill_one(pair)
+                delay = self.refill_interval
+            except Exception:
+                delay = FAILURE_BACKOFF  # 限流 / 断网时别一直重试
+            with self.lock:
+                self.queued.discard(pair)
+            self._request(pair)  # 还不够 variants 条时重新排队
+            time.sleep(delay)
@@ -0,0 +1,262 @@
+"""进程级的模型请求调度：限流、重试、同请求合并
+
+- 每个 API Key 一个令牌桶，所有会话 / 批处理共用；交互请求优先于批处理拿令牌
+- 429 / 5xx / 超时按带抖动的指数退避重试，重试用尽抛 ServiceBusyError
+- 同时在途的完全相同请求 (同一模型对象 + 相同输入) 只打一次上游，结果共享；
+  流式请求共享同一条上游流，后到的读者先重放已到达的块再跟上
+
+环境变量 AIASSI_RPM 设置每个 Key 每分钟的请求数上限，0 为不限。
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_RPM = float(os.environ.get("AIASSI_RPM", "60"))
+DEFAULT_BURST = 5
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 20.0
+# 最多保留多少个 API Key 的调度器，超出时淘汰最久没用过的
+MAX_SCHEDULERS = 64
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                   "DeadlineExceeded", "GatewayTimeout", "BadGateway"}
+
+
+class ServiceBusyError(RuntimeError):
+    """可重试的错误在重试用尽后仍然失败"""
+
+
+def is_retryable(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    if type(exc).__name__ in RETRYABLE_NAMES:
+        return True
+    code = getattr(exc, "code", None)
+    code = getattr(code, "value", code)  # google.api_core 的 code 可能是枚举
+    return code in RETRYABLE_CODES
+
+
+class TokenBucket:
+    """rpm 为 0 时不限流。批处理请求在有交互请求排队时让行。"""
+
+    def __init__(self, rpm, burst=DEFAULT_BURST):
+        self.cond = threading.Condition()
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.interactive_waiting = 0
+        self.set_rate(rpm)
+
+    def set_rate(self, rpm):
+        with self.cond:
+            self.rate = rpm / 60.0
+
+    def acquire(self, priority=INTERACTIVE):
+        with self.cond:
+            if priority == INTERACTIVE:
+                self.interactive_waiting += 1
+            try:
+                while True:
+                    if not self.rate:
+                        return
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1 and (priority == INTERACTIVE or not self.interactive_waiting):
+                        self.tokens -= 1
+                        return
+                    self.cond.wait(max(0.01, (1 - self.tokens) / self.rate))
+            finally:
+                if priority == INTERACTIVE:
+                    self.interactive_waiting -= 1
+                    self.cond.notify_all()
+
+
+class SingleFlight:
+    """相同 key 的并发调用只执行一次，其余调用等待并共享结果 (包括异常)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result(), True
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+        return future.result(), False
+
+
+class BroadcastStream:
+    """一条上游流式响应，由后台线程拉取，块按到达顺序存起来供多个读者重放"""
+
+    def __init__(self, response):
+        self.response = response
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def pump(self):
+        try:
+            for chunk in self.response:
+                with self.cond:
+                    self.chunks.append(chunk)
+                    self.cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+
+class StreamReader:
+    """单个读者：从第一个块开始迭代；其他属性 (usage_metadata 等) 等上游结束后取自原响应"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def __iter__(self):
+        source = self.source
+        i = 0
+        while True:
+            with source.cond:
+                while i >= len(source.chunks) and not source.done:
+                    source.cond.wait()
+                if i < len(source.chunks):
+                    chunk = source.chunks[i]
+                elif source.error is not None:
+                    raise source.error
+                else:
+                    return
+            i += 1
+            yield chunk
+
+    def __getattr__(self, name):
+        with self.source.cond:
+            while not self.source.done:
+                self.source.cond.wait()
+        return getattr(self.source.response, name)
+
+
+class RequestScheduler:
+    def __init__(self, rpm=DEFAULT_RPM, max_attempts=MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rpm)
+        self.flights = SingleFlight()
+        self.streams = {}  # key -> 仍在拉取中的 BroadcastStream
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "coalesced": 0, "failures": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _attempt(self, fn, priority, limited):
+        for attempt in range(self.max_attempts):
+            if limited:
+                self.bucket.acquire(priority)
+            self._count("calls")
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_attempts - 1:
+                    self._count("failures")
+                    raise ServiceBusyError(f"模型服务繁忙，已重试 {self.max_attempts - 1} 次：{e}") from e
+                self._count("retries")
+                # full jitter，避免多个会话同时被限流后又同时重试
+                time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+
+    def run(self, fn, priority=INTERACTIVE, key=None, limited=True):
+        """执行一次上游调用；key 不为空时与在途的同 key 请求合并"""
+        if key is None:
+            return self._attempt(fn, priority, limited)
+        result, shared = self.flights.do(key, lambda: self._attempt(fn, priority, limited))
+        if shared:
+            self._count("coalesced")
+        return result
+
+    def stream(self, fn, priority=INTERACTIVE, key=None):
+        """流式调用：建立连接这一步限流 / 重试；同 key 的在途流只建立一次连接，块分发给所有读者"""
+        if key is None:
+            return self._attempt(fn, priority, True)
+        with self.lock:
+            source = self.streams.get(key)
+        if source is None:
+            source, shared = self.flights.do(("stream", key), lambda: self._open_stream(fn, priority, key))
+        else:
+            shared = True
+        if shared:
+            self._count("coalesced")
+        return StreamReader(source)
+
+    def _open_stream(self, fn, priority, key):
+        source = BroadcastStream(self._attempt(fn, priority, True))
+        with self.lock:
+            self.streams[key] = source
+        threading.Thread(target=self._pump, args=(key, source), name="stream-pump", daemon=True).start()
+        return source
+
+    def _pump(self, key, source):
+        source.pump()
+        with self.lock:
+            if self.streams.get(key) is source:
+                del self.streams[key]
+
+
+_schedulers = OrderedDict()  # Key 哈希 -> RequestScheduler，按最近使用排序
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(api_key, rpm=None):
+    """每个 API Key 一个进程级调度器；传入 rpm 时更新该 Key 的限速。
+    最多保留 MAX_SCHEDULERS 个，淘汰的调度器仍被持有它的后端正常使用，只是不再共享给新后端。"""
+    key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = RequestScheduler(DEFAULT_RPM if rpm is None else rpm)
+            while len(_schedulers) > MAX_SCHEDULERS:
+                _schedulers.popitem(last=False)
+        else:
+            _schedulers.move_to_end(key)
+            if rpm is not None:
+                scheduler.bucket.set_rate(rpm)
+    return scheduler
+
+
+def describe_contents(contents):
+    """把请求输入变成稳定的指纹文本：文件取远端名，inline blob 取内容哈希"""
+    if isinstance(contents, (list, tuple)):
+        return "|".join(describe_contents(c) for c in contents)
+    if isinstance(contents, dict) and "data" in contents:
+        return f"{contents.get('mime_type')}:{hashlib.sha256(contents['data']).hexdigest()}"
+    return getattr(contents, "name", None) or str(contents)
+
+
+def request_key(model, contents, kind="generate"):
+    # 模型对象在请求在途期间一直存活，id 不会被复用
+    payload = f"{kind}|{id(model)}|{describe_contents(contents)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
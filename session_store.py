@@ -0,0 +1,262 @@
+"""会话内存预算：长历史落盘、按预算收缩、空闲会话回收云端文件
+
+- SpillList：对话历史只在内存里保留最近几轮，更早的追加写进会话目录下的 JSONL，
+  按下标 / 切片访问时再从磁盘读回，接口与 list 一致
+- SessionRegistry：进程级登记每个会话的内存占用和云端资源。超出单会话或全局预算时
+  把历史整体落盘、丢掉已完成会议任务的音频；会话断开且空闲超时后删除它独占的云端文件
+  和上下文缓存，清掉落盘目录。标签页仍然连着的会话不回收。
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import metrics
+
+SESSION_DIR = os.path.join(os.environ.get("AIASSI_CACHE_DIR", os.path.expanduser("~/.cache/aiassi")), "sessions")
+HOT_TURNS = 40
+SESSION_BUDGET = 8 * 1024 * 1024
+GLOBAL_BUDGET = 512 * 1024 * 1024
+IDLE_TTL = 30 * 60
+JANITOR_INTERVAL = 60
+
+
+class SpillList:
+    """超过 2 * hot 条时把最旧的部分写盘，内存里留最近 hot 条；元素需可 JSON 序列化 (元组读回后仍是元组)"""
+
+    def __init__(self, path, hot=HOT_TURNS):
+        self.path = path
+        self.hot = hot
+        self.lock = threading.RLock()
+        self.tail = []
+        self.offsets = []  # 已落盘的每一条在文件里的起始偏移
+
+    def __len__(self):
+        with self.lock:
+            self._check()
+            return len(self.offsets) + len(self.tail)
+
+    def _check(self):
+        """落盘文件被空闲回收删掉后，已落盘的部分作废，只保留内存里的最近几轮"""
+        if self.offsets and not os.path.exists(self.path):
+            self.offsets = []
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        with self.lock:
+            self._check()
+            if isinstance(index, slice):
+                return [self._get(i) for i in range(*index.indices(len(self)))]
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("history index out of range")
+            return self._get(index)
+
+    def _get(self, i):
+        if i >= len(self.offsets):
+            return self.tail[i - len(self.offsets)]
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[i])
+            item = json.loads(f.readline())
+        return tuple(item["t"]) if "t" in item else item["v"]
+
+    def append(self, item):
+        with self.lock:
+            self.tail.append(item)
+            if len(self.tail) > 2 * self.hot:
+                self.spill(len(self.tail) - self.hot)
+
+    def spill(self, n=None):
+        """把最旧的 n 条 (默认全部) 写盘"""
+        with self.lock:
+            n = len(self.tail) if n is None else min(n, len(self.tail))
+            if not n:
+                return
+            self._check()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                for item in self.tail[:n]:
+                    self.offsets.append(f.tell())
+                    record = {"t": list(item)} if isinstance(item, tuple) else {"v": item}
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            del self.tail[:n]
+
+    def clear(self):
+        with self.lock:
+            self.tail = []
+            self.offsets = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def memory_bytes(self):
+        with self.lock:
+            return estimate_size(self.tail) + 8 * len(self.offsets)
+
+
+class MappedView:
+    """只读视图：view[i] = fn(history[i])，只覆盖前 stop 条；切片时才真正读取"""
+
+    def __init__(self, history, fn, stop=None):
+        self.history = history
+        self.fn = fn
+        self.stop = len(history) if stop is None else stop
+
+    def __len__(self):
+        return self.stop
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop)
+            return [self.fn(item) for item in self.history[start:stop:step]]
+        if index < 0:
+            index += self.stop
+        return self.fn(self.history[index])
+
+
+def estimate_size(obj, seen=None, depth=0):
+    """粗略估算对象占用的字节数：递归统计容器、dataclass 等普通对象的属性 (最多 8 层)"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > 8:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, SpillList):
+        return obj.memory_bytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, seen, depth + 1) + estimate_size(v, seen, depth + 1) for k, v in list(obj.items()))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen, depth + 1) for item in list(obj))
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += estimate_size(vars(obj), seen, depth + 1)
+    return size
+
+
+class SessionRegistry:
+    def __init__(self, session_budget=SESSION_BUDGET, global_budget=GLOBAL_BUDGET, idle_ttl=IDLE_TTL, root=SESSION_DIR,
+                 is_connected=lambda session_id: False):
+        """is_connected(session_id) 返回该会话的标签页是否仍然连着；连着的会话再久没操作也不回收"""
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.idle_ttl = idle_ttl
+        self.root = root
+        self.is_connected = is_connected
+        self.lock = threading.Lock()
+        self.collected = {}  # 已回收的 session_id -> 回收时间，会话重连时据此重新挂载文档
+        # session_id -> {"values", "bytes", "last_seen", "remote": {文件名: (backend, upload_cache)}, "caches": [...]}
+        # values 是 session_state 的浅拷贝：st.session_state 只能在本会话的脚本线程里读
+        self.sessions = {}
+        threading.Thread(target=self._janitor, name="session-janitor", daemon=True).start()
+
+    def revive(self, session_id):
+        """会话的云端文件 / 缓存是否已被回收过 (每个会话只返回一次 True)，是则需要重新挂载文档"""
+        with self.lock:
+            return self.collected.pop(session_id, None) is not None
+
+    def history(self, session_id, name):
+        return SpillList(os.path.join(self.root, session_id, f"{name}.jsonl"))
+
+    def _measure(self, entry):
+        return sum(estimate_size(v) for v in entry["values"].values())
+
+    def touch(self, session_id, state, skip=()):
+        """每次脚本运行时调用：更新活跃时间和内存占用，超出预算时收缩。返回本会话的字节数。
+        skip 为跨会话共享 (如 st.cache_resource 返回) 的键，不计入本会话。"""
+        values = {k: v for k, v in state.items() if k not in skip}
+        with self.lock:
+            entry = self.sessions.setdefault(session_id, {"remote": {}, "caches": []})
+            entry.update(values=values, last_seen=time.time())
+        entry["bytes"] = self._measure(entry)
+        if entry["bytes"] > self.session_budget:
+            entry["bytes"] = self._shrink(entry)
+        with self.lock:
+            total = sum(e.get("bytes", 0) for e in self.sessions.values())
+            by_idle = sorted(self.sessions.values(), key=lambda e: e["last_seen"])
+        for other in by_idle:
+            if total <= self.global_budget:
+                break
+            before = other.get("bytes", 0)
+            other["bytes"] = self._shrink(other)
+            total -= before - other["bytes"]
+        self._report()
+        return entry["bytes"]
+
+    def _shrink(self, entry):
+        for value in entry["values"].values():
+            if isinstance(value, SpillList):
+                value.spill()
+            elif isinstance(value, dict):
+                # 已完成的会议任务只需要分段笔记，片段音频可以丢掉
+                for job in value.values():
+                    if getattr(job, "segments", None) and not job.pending:
+                        for seg in job.segments:
+                            seg.data = b""
+        return self._measure(entry)
+
+    def track_files(self, session_id, backend, upload_cache, files):
+        """登记会话用到的云端文件，空闲回收时只删除没有其他活跃会话在用的"""
+        with self.lock:
+            entry = self.sessions.setdefault(session_id, {"remote": {}, "caches": [], "values": {}, "last_seen": time.time()})
+            for f in files:
+                entry["remote"][f.name] = (backend, upload_cache)
+
+    def track_cache(self, session_id, cache):
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions[session_id]["caches"].append(cache)
+
+    def _report(self):
+        with self.lock:
+            sizes = [e.get("bytes", 0) for e in self.sessions.values()]
+        metrics.set_gauge("sessions", len(sizes))
+        metrics.set_gauge("session_bytes_total", sum(sizes))
+        metrics.set_gauge("session_bytes_max", max(sizes, default=0))
+
+    def collect_idle(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            stale = [sid for sid, e in self.sessions.items() if now - e["last_seen"] > self.idle_ttl]
+        idle_ids = [sid for sid in stale if not self._connected(sid)]
+        with self.lock:
+            idle = {sid: self.sessions.pop(sid) for sid in idle_ids if sid in self.sessions}
+            # 断开的会话过了运行时的保留期就不会再重连，记录不必一直留着
+            self.collected = {sid: t for sid, t in self.collected.items() if now - t < self.idle_ttl}
+            self.collected.update((sid, now) for sid in idle)
+            in_use = {name for e in self.sessions.values() for name in e["remote"]}
+        for sid, entry in idle.items():
+            for name, (backend, upload_cache) in entry["remote"].items():
+                if name in in_use:
+                    continue
+                from ingest import forget_upload
+                forget_upload(upload_cache, name)
+                try:
+                    backend.delete_file(name)
+                except Exception:
+                    pass  # 服务端 48 小时后也会自动删除
+            for cache in entry["caches"]:
+                try:
+                    cache.delete()
+                except Exception:
+                    pass
+            shutil.rmtree(os.path.join(self.root, sid), ignore_errors=True)
+        if idle:
+            self._report()
+        return len(idle)
+
+    def _connected(self, session_id):
+        try:
+            return self.is_connected(session_id)
+        except Exception:
+            return True  # 查不到连接状态时宁可不回收
+
+    def _janitor(self):
+        while True:
+            time.sleep(JANITOR_INTERVAL)
+            try:
+                self.collect_idle()
+            except Exception:
+                pass
@@ -0,0 +1,128 @@
+"""口语陪练的后台语音合成
+
+回复一到就按句子切块丢进线程池合成，结果放进 (文本, 语言) 为键的 LRU；
+失败也会缓存一段时间，不会在每次 rerun 时重新阻塞页面。
+合成器可替换：默认 gTTS，测试时可以传 StubSynthesizer。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import metrics
+
+# 页面用的语言代码 -> gTTS 语言代码
+GTTS_LANGS = {'ko-KR': 'ko', 'ja-JP': 'ja', 'en-US': 'en', 'fr-FR': 'fr', 'th-TH': 'th'}
+
+SENTENCE_RE = re.compile(r"[^.!?。！？\n]+[.!?。！？]*\s*")
+FAILED = object()
+
+
+def gtts_synthesize(text, lang_code):
+    from gtts import gTTS
+    fp = BytesIO()
+    gTTS(text=text, lang=GTTS_LANGS.get(lang_code, lang_code)).write_to_fp(fp)
+    return fp.getvalue()
+
+
+class StubSynthesizer:
+    """离线合成器：固定延迟，返回可预测的假 MP3 字节"""
+
+    def __init__(self, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self, text, lang_code):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("stub synthesizer failure")
+        return f"ID3:{lang_code}:{text}".encode("utf-8")
+
+
+def split_sentences(text, max_chars=200):
+    """按句切块，短句合并到 max_chars 以内，首块尽量短以便更早开始播放"""
+    sentences = [s.strip() for s in SENTENCE_RE.findall(text) if s.strip()] or [text.strip()]
+    chunks = [sentences[0]]
+    for sentence in sentences[1:]:
+        if len(chunks) > 1 and len(chunks[-1]) + len(sentence) + 1 <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+class TTSEngine:
+    def __init__(self, synthesizer=gtts_synthesize, workers=4, max_entries=512, failure_ttl=300):
+        self.synthesizer = synthesizer
+        self.max_entries = max_entries
+        self.failure_ttl = failure_ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # (chunk, lang) -> bytes | (FAILED, 失败时间)
+        self.inflight = {}  # (chunk, lang) -> Future
+
+    def _synthesize(self, key):
+        chunk, lang_code = key
+        try:
+            with metrics.timer("tts"):
+                result = self.synthesizer(chunk, lang_code) or (FAILED, time.monotonic())
+        except Exception:
+            result = (FAILED, time.monotonic())
+        with self.lock:
+            self.inflight.pop(key, None)
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def _lookup(self, key):
+        """调用方需持有锁：命中返回 bytes / FAILED，未命中或失败已过期返回 None"""
+        result = self.cache.get(key)
+        if result is None:
+            return None
+        if isinstance(result, tuple):
+            if time.monotonic() - result[1] < self.failure_ttl:
+                return FAILED
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return result
+
+    def put(self, chunk, lang_code, audio):
+        """写入已合成好的音频块 (如开场白池里预合成的语音)"""
+        with self.lock:
+            self.cache[(chunk, lang_code)] = audio
+            self.cache.move_to_end((chunk, lang_code))
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def submit(self, text, lang_code):
+        """后台预合成，不阻塞"""
+        with self.lock:
+            for chunk in split_sentences(text):
+                key = (chunk, lang_code)
+                if key not in self.inflight and self._lookup(key) is None:
+                    self.inflight[key] = self.pool.submit(self._synthesize, key)
+
+    def get(self, text, lang_code):
+        """返回 (已就绪的音频块列表, 是否仍在合成, 是否有块失败)；未提交过的会自动提交
+
+        音频块按顺序返回，遇到还没合成好的块就停下，保证播放顺序。
+        """
+        self.submit(text, lang_code)
+        ready, pending, failed = [], False, False
+        with self.lock:
+            for chunk in split_sentences(text):
+                result = self._lookup((chunk, lang_code))
+                if result is FAILED:
+                    failed = True
+                elif result is None:
+                    pending = True
+                    break
+                elif not failed:
+                    ready.append(result)
+        return ready, pending, failed